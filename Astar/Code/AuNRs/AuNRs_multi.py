@@ -0,0 +1,74 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.astar_optimizer import build_neighbour_graph
+from common.feature_index import FeatureIndex
+from common.feature_table import FEATURE_TABLE
+from common.file_cache import CACHE_DIR
+from common.report import read_output, write_output
+from common.simulation import Campaign, replay, run_restarts, save_table, summarize
+from common.surrogate import Surrogate
+
+# Candidate wells with their formula and peak features, written by build_feature_table.py
+data = read_output(FEATURE_TABLE)
+# Rows sorted by LSPR position, so the starting rows of a window are found without scanning
+peak_wave_index = FeatureIndex(data['2nd_peak_wave'].values, data.index.values)
+
+# Formulas count as neighbours when every reagent differs by less than its threshold (mL);
+# built once and shared by every target and restart
+HCL_thres = 0.06
+AgNO3_thres = 0.06
+SEED_thres = 0.004
+formula_cols = ['3.6542M 盐酸/mL', '4mM AgNO3/mL', '晶种/mL']
+neighbour_graph = build_neighbour_graph(data, formula_cols, [HCL_thres, AgNO3_thres, SEED_thres])
+# Memory-mapped by the simulation workers, one directory per table
+table_dir = save_table(f'{CACHE_DIR}/AuNRs_simulation', data, neighbour_graph, formula_cols)
+
+# LSPR, peak ratio and FWHM (2nd_peak_wave, 2nd_peak_ratio, 2nd_peak_fwhm) in one pass: they share
+# the neighbours and sn of every row
+# for target in [600, 650, 700, 750, 800, 850, 900]:
+for target in [700]:
+    MAX_STEP = 100
+    # Nearest unvisited neighbours that take the zi of each experiment
+    DELTA_CNT = 10
+    # Acquisition rule of si_ucb: ucb1, decaying_ucb or thompson
+    ACQUISITION = 'ucb1'
+    # Experiments per plate (e.g. 12 for one reader row) and the si_ucb a candidate loses for
+    # every neighbour already on the plate
+    BATCH_SIZE = 1
+    PENALTY = 0.05
+    # Blend si_ucb with a surrogate model of zi over the finished experiments: 'knn', 'gp' or None
+    # to keep si_ucb alone; one unit of the model is one neighbour threshold along every reagent
+    SURROGATE = None
+    surrogate = Surrogate(SURROGATE, formula_cols, (HCL_thres, AgNO3_thres, SEED_thres)) if SURROGATE else None
+    # weighted: si is the weighted sum of the objectives (w1, w2, w3)
+    # pareto: new random weights for every plate, to spread the experiments over the front
+    MODE = 'pareto'
+    WEIGHTS = (1, 1, 1)
+    # 5 starting points, 1 of them with the LSPR within 50nm of the target
+    campaign = Campaign(('lspr', 'peak_ratio', 'fwhm'), target, 5, 1, 50, MAX_STEP, DELTA_CNT,
+                        acquisition=ACQUISITION, batch_size=BATCH_SIZE, penalty=PENALTY, mode=MODE, weights=WEIGHTS,
+                        surrogate=surrogate)
+    runs = run_restarts(table_dir, campaign, range(200))
+    print(summarize(runs).to_string(index=False))
+    write_output(runs, f'Astar_multi_runs_{target}')
+
+    # Keep the campaign with the best weighted zi, replayed from its seed
+    restart = runs.loc[runs['best_zi'].idxmax(), 'restart']
+    # Saved after every plate so that an interrupted replay picks up where it stopped, and
+    # removed once its result is written
+    checkpoint = f'{CACHE_DIR}/Astar_multi_{target}_{restart}_state.npz'
+    search, _, _ = replay(data, neighbour_graph, peak_wave_index, campaign, restart, checkpoint=checkpoint)
+    write_output(search.closed_frame(), f'Astar_multi_{target}')
+    # Experiments that no other experiment of the campaign beats on every objective
+    write_output(search.front_frame(), f'Astar_front_{target}')
+    os.remove(checkpoint)
+
+# Pareto front of the last target, see export_excel.py for a workbook copy
+tdata = read_output(f'Astar_front_{target}')
+tdata[['4mM AgNO3/mL',
+       '3.6542M 盐酸/mL',
+       '晶种/mL', 'wave_name', 'label', 'peak_num',
+       '2nd_peak_wave', '2nd_peak_width', '2nd_peak_ratio', '2nd_peak_diff',
+       'step', 'zi_lspr', 'zi_peak_ratio', 'zi_fwhm', 'zi']]
\ No newline at end of file
@@ -0,0 +1,25 @@
+'''
+    Build the AuNRs candidate table from the UV-Vis plates and their parameter sheets
+'''
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.feature_table import FEATURE_TABLE, PARAM_COLS, build_feature_table, get_candidates
+from common.file_cache import CACHE_DIR
+from common.report import write_output
+from common.spectral_index import SpectralIndex, get_formula
+
+param_wave_dir_list = ["AuNRs_data/UV-Vis_Data",
+                       "AuNRs_data/param"
+                       ]
+wells, spectral_store, failures = build_feature_table(param_wave_dir_list)
+for name, error in failures:
+    print(f'skip {name}: {error}')
+
+data = get_candidates(wells)
+print(f'{len(data)} wells -> {write_output(data, FEATURE_TABLE)}')
+
+# Add new plates to the nearest-neighbour index over the experiment history
+formula = get_formula(spectral_store, wells.assign(key='_' + wells['label']), PARAM_COLS, 'key', 'wave_name')
+SpectralIndex.open(f'{CACHE_DIR}/spectral_index').add('AuNRs', spectral_store, formula)
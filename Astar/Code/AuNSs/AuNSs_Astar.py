@@ -3,332 +3,33 @@
 '''
 import pandas as pd
 import os
-import re
-from enum import Enum
-
-
-class FileFormat(Enum):
-    txt = "txt"
-    xlsx = "xlsx"
-
-
-def get_file_data(fname):
-    values = []
-    tag_idx = -1
-    with open(fname, encoding='gbk') as f:
-        for idx, line in enumerate(f):
-            v = line.split('\t')
-            if v[0] == u'波长':
-                tag_idx = idx
-            if idx == tag_idx + 1:
-                values = v
-    usecols = list(filter(lambda x: x != '', [idx if val not in ['', '\n'] else '' for idx, val in enumerate(values)]))
-    data = pd.read_csv(fname, encoding='gbk',
-                       skiprows=list(range(0, tag_idx)) + list(range(tag_idx + 2 + 400, tag_idx + 400 + 100)), sep='\t',
-                       usecols=usecols).iloc[:401, :]
-    return data
-
-
-'''
-    Extract parameter files and UV-Vis files
-'''
-param_wave_dir_list = ["AuNSs_data/formula",
-                       #                        "AuNSs_data/small size", "AuNSs_data/large size",
-                       #                        "AuNSs_data/polyhedron",
-                       "AuNSs_data/normalization"
-                       ]
-wave_name_dict = {}
-param_name_list = []
-
-
-def get_file_name_and_day(file_dir):
-    for fname in os.listdir(file_dir):
-        print(f'parse {fname}')
-        if fname.startswith('.'):
-            continue
-        name, day, fmt = re.findall(f'([\u4e00-\u9fa5a-zA-Z]*)-([\w-]+).(txt|xlsx)', fname)[0]
-        data = None
-        file_path = f'{file_dir}/{fname}'
-        #         print(file_path, fname, name, day, fmt)
-
-        if FileFormat(fmt) == FileFormat.txt:
-            data = get_file_data(file_path)
-            wave_name_dict[f'{name}_{day}'] = data
-        elif FileFormat(fmt) == FileFormat.xlsx:
-            data = pd.read_excel(file_path)
-            if 'normalization' in file_dir:
-                wave_name_dict[f'{name}_{day}'] = data
-            else:
-                data['day'] = day
-                param_name_list.append(data)
-        else:
-            print('error format')
-
-
-for dir_name in param_wave_dir_list:
-    get_file_name_and_day(dir_name)
-
-data_param = pd.concat(param_name_list, axis=0).fillna(value=0).reset_index(drop=True)
-
-'''
-    Merge duplicate fields
-'''
-merge_cols = [['处理样品', '样品编号'], ['10mM HAuCl4', '10mM HAuCl4/mL']]
-for col in merge_cols:
-    data_param[col[0]] = data_param[col].apply(lambda x: max(x[col[0]], x[col[1]]), axis=1)
-    del data_param[col[1]]
-
-'''
-    Match the target curve and calculate the error
-'''
-
-from math import ceil
-import matplotlib.pyplot as plt
-
-data_target = pd.read_excel('target/归一化uv数据.xlsx', skiprows=2)
-use_cols = list(filter(lambda x: 'Unnamed' not in x, data_target.columns))
-wave_cols = list(filter(lambda x: '波长' in x, use_cols))
-absor_cols = list(filter(lambda x: '吸光度' in x, use_cols))
-data_target = data_target[use_cols].fillna(value=0)
-
-'''
-    Round up the horizontal axis of the target curve
-'''
-
-for wcol, acol in zip(wave_cols, absor_cols):
-    data_target[f'{wcol}_ceil'] = data_target[wcol].apply(lambda x: ceil(float(x)))
-#     data_target.plot(x=wcol, y=acol, figsize=(20,10), title=data_target[[wcol]].columns[0])
-#     plt.show()
-# data_target.head()
-
-data_target.plot(x=wcol, y=absor_cols, figsize=(20, 10), title='target_wave')
-plt.show()
-
-'''
-    Extract wavelength and absorbance curves for each size
-    Compare wavelengths in different intervals
-'''
-target_size = ['24nm', '54nm', '69nm', '88nm']
-'''
-    Calculate the difference in waveform curve
-'''
-
-
-def calculate_distance(source, source_index, source_val, target, target_index, target_val):
-    try:
-        data = pd.merge(left=source, right=target, left_on=source_index, right_on=target_index, how='inner')
-        data['diff'] = data.apply(lambda row: pow((row[source_val] - row[target_val]), 2), axis=1)
-        return data['diff'].mean()
-    except Exception as e:
-        print('exception:', e)
-        print(source_index, source_val, target_index, target_val)
-        print(source.dtypes)
-        print(target.dtypes)
-
-
-'''
-    Calculate the difference in peak position
-'''
-from scipy.signal import find_peaks, peak_widths
-
-
-# Absorbance wavelength
-def get_peak_wave(arr, data):
-    peaks, properties = find_peaks(arr, prominence=0.03)
-    peak_wids = peak_widths(arr, peaks, rel_height=0.5)
-    return data[peaks[0]]
-
-
-# get_peak_wave(wave_name_dict['多面体AuNSs_20230921-2']['A1'].values,\
-#                wave_name_dict['多面体AuNSs_20230921-2']['波长'].values)
-
-def calculate_peak_diff(source_wave, source_idx, target_wave, target_idx):
-    try:
-        peak_source = get_peak_wave(source_wave, source_idx)
-        peak_target = get_peak_wave(target_wave, target_idx)
-        peak_error = peak_source - peak_target
-        print(f'peak_source:{peak_source} peak_target:{peak_target} peak_error:{peak_error}')
-        return peak_error, peak_source, peak_target
-
-    except Exception as e:
-        print('exception:', e)
-        return 0, 0, 0
-
-
-import numpy as np
-
-
-def get_near_wave(wave_name_dict, wave_cols, absor_cols, data_target, exp_target_diff):
-    for day, wave_data in wave_name_dict.items():
-        #         wave_data['波长_int'] = wave_data['波长'].astype(int)
-        for wave_index in wave_data.columns.values[1:]:
-            diff_list = []
-            wave_diff_list = []
-            wave_pk_list = []
-            for idx, (wcol, tcol) in enumerate(zip(wave_cols, absor_cols)):
-                diff = calculate_distance(wave_data, '波长', wave_index, \
-                                          data_target[[f'{wcol}_ceil', tcol]], f'{wcol}_ceil', tcol)
-                diff_list.append(diff)
-                print(wcol, tcol)
-                wave_diff, soure_pk, target_pk = calculate_peak_diff(wave_data[wave_index].values,
-                                                                     wave_data['波长'].values, \
-                                                                     data_target[tcol].values, data_target[wcol].values)
-                wave_diff_list.append(wave_diff)
-                wave_pk_list.append([soure_pk, target_pk])
-
-            # Take the curve with the smallest error
-            min_idx = np.argmin(diff_list)
-            min_idx_peak = np.argmin(wave_diff_list)
-            min_idx_peak = 1
-
-            print(day, wave_index, tcol, target_size[min_idx], diff_list[min_idx], \
-                  target_size[min_idx_peak], wave_diff_list[min_idx_peak])
-            exp_target_diff['day'].append(day)
-            exp_target_diff['wave'].append(wave_index)
-            exp_target_diff['size'].append(target_size[min_idx])
-            exp_target_diff['wave_error'].append(diff_list[min_idx])
-            exp_target_diff['peak_size'].append(target_size[min_idx_peak])
-            exp_target_diff['peak_error'].append(wave_diff_list[min_idx_peak])
-            exp_target_diff['peak_source'].append(wave_pk_list[min_idx_peak][0])
-            exp_target_diff['peak_target'].append(wave_pk_list[min_idx_peak][1])
-
-
-exp_target_diff = {
-    'day': [],
-    'wave': [],
-    'size': [],
-    'wave_error': [],
-    'peak_size': [],
-    'peak_error': [],
-    'peak_source': [],
-    'peak_target': []
-}
-get_near_wave(wave_name_dict, wave_cols, absor_cols, data_target, exp_target_diff)
-exp_target_diff_pd = pd.DataFrame(exp_target_diff)
-exp_target_diff_pd.to_excel('output/exp_target_diff.xlsx', header=True, index=False)
-
-'''
-    Merge parameters and curves
-'''
-
-
-def get_full_day_name(row):
-    type_name = ''
-    if row['type(1小尺寸，2-多面体，3-大尺寸)'] == 1.0:
-        type_name = '小尺寸'
-    elif row['type(1小尺寸，2-多面体，3-大尺寸)'] == 2.0:
-        type_name = '多面体'
-    elif row['type(1小尺寸，2-多面体，3-大尺寸)'] == 3.0:
-        type_name = '大尺寸'
-    day = row['day']
-    idx = int(row['处理样品'])
-    return f'{type_name}AuNSs_{day}-{idx}'
-
-
-data_param['day'] = data_param.apply(get_full_day_name, axis=1)
-
-
-def get_full_wave_name(name):
-    mathes = re.findall(f'([\u4e00-\u9fa5a-zA-Z]*)_([\w]+)-([\w]+)', name)
-    if len(mathes) > 0:
-        return name
-    else:
-        return f'{name}-1'
-
-
-exp_target_diff_pd['day'] = exp_target_diff_pd['day'].apply(get_full_wave_name)
-
-exp_target_diff_pd['day_wave'] = exp_target_diff_pd.apply(lambda row: row['day'] + '_' + row['wave'], axis=1)
-data_param['day_wave'] = data_param.apply(lambda row: row['day'] + '_' + row['波名'], axis=1)
-
-data_param_wave = pd.merge(left=data_param, right=exp_target_diff_pd, on=['day_wave', 'day'], how='inner')
-data_param_wave.head()
-
-import random
-import math
-
-
-# Algorithm begins
-# The close set is empty
-# The open set is empty
-
-# # Calculate valuation function
-
-
-def get_zi_func(x, MAX_VALUE=1):
-    # Normalization
-    z = 1.0 - (x / MAX_VALUE)
-
-    return z
-
-
-def get_target_zi_func(x, TARGET_PEAK=7.0, MAX_VALUE=50):
-    # Normalization closest to the goal
-    z = 1 - (abs(x - TARGET_PEAK) / MAX_VALUE)
-
-    return z
-
-
-'''
-    Minimum error in small-sized curves
-'''
-
-
-def small_size_filer(x):
-    if re.findall(r'小尺寸AuNSs_', x['day']):
-        return True
-    else:
-        return False
-
-
-'''
-    Minimum peak position error at polyhedral curves
-
-'''
-
-
-def polyhedron_filer(x):
-    if re.findall(r'大尺寸AuNSs_2023(0627-1|0716-1|0716-2|0921-2|0921-3|0921-1|1226)', x['day']) and re.findall(r'A', x[
-        'wave']):
-        return True
-    else:
-        return False
-
-
-data = data_param_wave[data_param_wave.apply(polyhedron_filer, axis=1)].reset_index(drop=True)
-
-
-# Calculate hash
-def get_hash_val(param_list):
-    ret = []
-    for param in param_list:
-        param = str(round(param, 3))
-        ret.append(param)
-    return hash(tuple(ret))
-
-
-# Build the initial closed set (including newly completed experiments), objectives, parameters, and zi list
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.astar_optimizer import (ParamGrid, build_closed_set, build_open_set, get_zi, lattice_set_state,
+                                     open_set_frame, restore_lattice_set)
+from common.checkpoint import from_json_array, load_checkpoint, save_checkpoint, to_json_array
+from common.curve_distance import get_target_curves
+from common.file_cache import CACHE_DIR
+from common.peak_features import PEAK_PROMINENCE, get_target_peaks
+from common.report import PlotReporter, write_output
+from common.score_manifest import get_score_hash, score_plates
+from common.ingest import ingest_dirs
+from common.spectral_index import SpectralIndex, get_formula
+from common.spectral_store import SpectralStore
+from common.surrogate import Surrogate, screen_open_set
+from common.target_matching import get_near_wave
+from common.well_keys import (SHAPE_LARGE, SHAPE_SMALL, format_day_names, get_formula_keys,
+                              get_spectrum_keys, join_wells)
+
+# Objective, parameters and dispense grid of the closed and open sets
+# Wells without a peak have no peak error to learn from
 target = 'peak_error'
 params = ['0.1M AA', '10mM HAuCl4']
-closed_set = {}
-
-
-def build_closed_set(closed_set, data, params, target):
-    for i in range(len(data)):
-        zi = get_target_zi_func(data.loc[i, target])
-        param_list = data.loc[i, params].values
-        param_list_hash = get_hash_val(param_list)
-        if param_list_hash not in closed_set:
-            closed_set[param_list_hash] = (param_list, [zi])
-        else:
-            closed_set[param_list_hash][1].append(zi)
-
-
-build_closed_set(closed_set, data, params, target)
+# Formulas are compared on the 1 uL dispense grid of the robot
+param_grid = ParamGrid([0.001, 0.001])
 
 # Construct the initial subset set as the open set based on the closed set, including parameters  si=zi_ist
-open_set = {}
-
 params_gap = [0.02, 0.02]  # Parameter variation amplitude
 params_gap_thres = [0.04, 0.04]  # Parameter variation range
 params_cnt_limit = 2
@@ -336,67 +37,159 @@ params_cnt_limit = 2
 params_near_gap = [0.005, 0.01]
 params_near_thres = [0.02, 0.02]
 
-
-def build_open_set(open_set, closed_set):
-    for pam_val_hash, (pam_val, zi) in closed_set.items():
-
-        # For each one-dimensional parameter, find n nodes within the nearby threshold range
-        for idx, param in enumerate(params):
-
-            # Expansion in both positive and negative directions
-            for i in range(2):
-                cnt = 0
-                gap = params_gap[idx]
-
-                # Expanding to a specified quantity or to a specified boundary has an impact on everything within the range
-                while cnt < params_cnt_limit and gap <= params_gap_thres[idx]:
-                    new_pam_val = pam_val.copy()
-                    new_pam_val[idx] += (gap if i == 0 else -gap)
-
-                    if new_pam_val[idx] <= 0:
-                        break
-
-                    new_pam_val_hash = get_hash_val(new_pam_val)
-                    if new_pam_val_hash not in closed_set and new_pam_val_hash not in open_set:
-                        open_set[new_pam_val_hash] = [new_pam_val, []]
-                        cnt += 1
-                    gap += params_gap[idx]
-
-            # Update in both positive and negative directions
-            for i in range(2):
-                gap = params_near_gap[idx]
-
-                # Expand to the specified boundary and have an impact on everything within the range
-                while gap <= params_near_thres[idx]:
-                    new_pam_val = pam_val.copy()
-                    new_pam_val[idx] += (gap if i == 0 else -gap)
-
-                    new_pam_val_hash = get_hash_val(new_pam_val)
-                    if new_pam_val_hash not in closed_set and new_pam_val_hash in open_set:
-                        open_set[new_pam_val_hash][1].extend(zi.copy())
-                    gap += params_near_gap[idx]
-
-
-build_open_set(open_set, closed_set)
+# Everything the saved sets depend on besides the plates
+settings = {'target': target, 'params': params, 'resolution': param_grid.resolution.tolist(),
+            'gap': params_gap, 'thres': params_gap_thres, 'cnt_limit': params_cnt_limit,
+            'near_gap': params_near_gap, 'near_thres': params_near_thres}
+
+# RESUME reuses the closed and open sets saved by the last run instead of reading the plates again;
+# sets saved with other settings are built again
+RESUME = False
+state_file = f'{CACHE_DIR}/AuNSs_state.npz'
+state = load_checkpoint(state_file) if RESUME else None
+if state is not None and from_json_array(state['settings']) != settings:
+    print(f'{state_file} was saved with other settings')
+    state = None
+if state is not None:
+    closed_set, open_set = restore_lattice_set(state, 'closed'), restore_lattice_set(state, 'open')
+else:
+    '''
+        Extract parameter files and UV-Vis files
+    '''
+    param_wave_dir_list = ["AuNSs_data/formula",
+                           #                        "AuNSs_data/small size", "AuNSs_data/large size",
+                           #                        "AuNSs_data/polyhedron",
+                           "AuNSs_data/normalization"
+                           ]
+    ingest = ingest_dirs(param_wave_dir_list)
+    for file_path, error in ingest.failures:
+        print(f'skip {file_path}: {error}')
+    param_name_list = ingest.param_name_list
+
+    # All spectra live in one memory-mapped matrix, keyed by f'{name}_{day}' as before
+    spectral_store = SpectralStore.build(f'{CACHE_DIR}/AuNSs_spectra', ingest.wave_name_dict)
+
+    data_param = pd.concat(param_name_list, axis=0).fillna(value=0).reset_index(drop=True)
+
+    '''
+        Merge duplicate fields
+    '''
+    merge_cols = [['处理样品', '样品编号'], ['10mM HAuCl4', '10mM HAuCl4/mL']]
+    for col in merge_cols:
+        data_param[col[0]] = data_param[col].apply(lambda x: max(x[col[0]], x[col[1]]), axis=1)
+        del data_param[col[1]]
+
+    '''
+        Match the target curve and calculate the error
+    '''
+
+    target_file = 'target/归一化uv数据.xlsx'
+    data_target = pd.read_excel(target_file, skiprows=2)
+    use_cols = list(filter(lambda x: 'Unnamed' not in x, data_target.columns))
+    wave_cols = list(filter(lambda x: '波长' in x, use_cols))
+    absor_cols = list(filter(lambda x: '吸光度' in x, use_cols))
+    data_target = data_target[use_cols].fillna(value=0)
+
+    '''
+        Resample the target curves onto the wavelength grid of the spectral store
+    '''
+    target_curves = get_target_curves(data_target, wave_cols, absor_cols, spectral_store.wavelength)
+
+    # Rendered to output/target_wave.png by a worker while the pipeline continues
+    reporter = PlotReporter()
+    reporter.plot(data_target, 'target_wave', x=wave_cols[-1], y=absor_cols, figsize=(20, 10), title='target_wave')
+
+    '''
+        Extract wavelength and absorbance curves for each size
+        Compare wavelengths in different intervals
+    '''
+    target_size = ['24nm', '54nm', '69nm', '88nm']
+
+    '''
+        Calculate the difference in peak position
+    '''
+    # Target peaks never change, so they are computed once
+    target_peaks = get_target_peaks(data_target, wave_cols, absor_cols)
+
+    # Peak errors are always taken against the 54nm target
+    peak_idx = 1
+
+    # Only plates that are new or changed since the last run with this target and settings are scored
+    score_hash = get_score_hash(target_file, spectral_store.wavelength, target_size=target_size, peak_idx=peak_idx,
+                                prominence=PEAK_PROMINENCE)
+    scores = score_plates(f'{CACHE_DIR}/AuNSs_scores', spectral_store, score_hash,
+                          lambda rows: get_near_wave(spectral_store, rows, target_curves, target_size, target_peaks,
+                                                     peak_idx=peak_idx))
+    print(f'score {len(scores.scored)} of {len(scores.results)} wells')
+    exp_target_diff_pd = scores.results
+    write_output(exp_target_diff_pd, 'exp_target_diff')
+
+    '''
+        Merge parameters and curves
+    '''
+
+    # Both sides are keyed by integer (material, shape, day, batch, well) codes; plates without
+    # a batch suffix are batch 1
+    param_keys = get_formula_keys(data_param, 'AuNSs', '处理样品')
+    wave_keys = get_spectrum_keys(exp_target_diff_pd['day'], exp_target_diff_pd['wave'])
+
+    data_param['day'] = format_day_names(param_keys)
+    exp_target_diff_pd['day'] = format_day_names(wave_keys)
+    exp_target_diff_pd['day_wave'] = exp_target_diff_pd['day'] + '_' + exp_target_diff_pd['wave']
+    data_param['day_wave'] = data_param['day'] + '_' + data_param['波名']
+
+    data_param_wave, data_param_wave_keys = join_wells(data_param, param_keys, exp_target_diff_pd, wave_keys)
+    data_param_wave.head()
+
+    '''
+        Add new plates to the nearest-neighbour index over the experiment history
+    '''
+    formula_cols = [col for col in data_param.columns if col not in ['day', 'day_wave']]
+    spectral_index = SpectralIndex.open(f'{CACHE_DIR}/spectral_index')
+    spectral_index.add('AuNSs', spectral_store, get_formula(spectral_store, data_param_wave, formula_cols))
+
+    '''
+        Minimum error in small-sized curves
+    '''
+
+    def small_size_filer(keys):
+        return (keys['shape'] == SHAPE_SMALL).values
+
+    '''
+        Minimum peak position error at polyhedral curves
+
+    '''
+
+    polyhedron_plates = pd.MultiIndex.from_tuples([(20230627, 1), (20230716, 1), (20230716, 2),
+                                                   (20230921, 1), (20230921, 2), (20230921, 3)])
+    polyhedron_days = [20231226]
+
+    def polyhedron_filer(keys):
+        # Row A of the large-size plates above, and of every plate of the days in polyhedron_days
+        plates = pd.MultiIndex.from_arrays([keys['day'], keys['plate']]).isin(polyhedron_plates)
+        return ((keys['shape'] == SHAPE_LARGE) & (plates | keys['day'].isin(polyhedron_days))
+                & (keys['well'] // 100 == 1)).values
+
+    data = data_param_wave[polyhedron_filer(data_param_wave_keys)].reset_index(drop=True)
+
+    # Build the initial closed set (including newly completed experiments) and the open set around it
+    closed_set = build_closed_set(data, params, get_zi(target, data), param_grid)
+    open_set = build_open_set(closed_set, param_grid, params_gap, params_gap_thres, params_cnt_limit,
+                              params_near_gap, params_near_thres, positive=True)
+    # Closed and open sets of this run, read back when RESUME is set
+    save_checkpoint(state_file, settings=to_json_array(settings), **lattice_set_state('closed', closed_set),
+                    **lattice_set_state('open', open_set))
+
+    reporter.close()
 
 # Select the topk with the largest si from the open collection
-open_set_params = list(open_set.values())
-import math
-
-param_exp_dict = {}
-for param in params + ['si', 'near_num', 'near_zi']:
-    param_exp_dict[param] = []
-for pam_val, zi_list in open_set_params:
-    #     print('before', pam_val)
-    #     pam_val = [round(x, 3) for x in pam_val]
-    #     print('after', pam_val)
-    for idx, param in enumerate(params):
-        #         print('after', pam_val[idx])
-        param_exp_dict[param].append(pam_val[idx])
-    param_exp_dict['si'].append(np.average(zi_list))
-    param_exp_dict['near_num'].append(len(zi_list))
-    param_exp_dict['near_zi'].append(zi_list)
-param_exp_pd = pd.DataFrame(param_exp_dict)
-param_exp_pd.sort_values(by='si', ascending=False, inplace=True)
-param_exp_pd.to_excel('./output/param_exp_poly_all.xlsx', header=True, index=False)
+param_exp_pd = open_set_frame(open_set, params, param_grid)
+# Re-rank the proposals on a surrogate model of zi over the closed set: 'knn', 'gp' or None, with
+# params_near_gap as one unit along every parameter; PRUNE drops those not expected to beat the best closed formula
+SURROGATE = None
+PRUNE = False
+if SURROGATE is not None:
+    surrogate = Surrogate(SURROGATE, params, params_near_gap)
+    param_exp_pd = screen_open_set(param_exp_pd, closed_set, params, param_grid, surrogate, prune=PRUNE)
+write_output(param_exp_pd, 'param_exp_poly_all')
 param_exp_pd.head(50)
\ No newline at end of file
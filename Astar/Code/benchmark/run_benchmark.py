@@ -0,0 +1,120 @@
+'''
+    Benchmark of the spectrum matching pipeline on synthetic campaigns
+    Usage: python run_benchmark.py [--scales 1 10 100] [--update-golden] [--keep DIR]
+    Every stage is timed and reported in wells per second. The exp_target_diff table of each
+    scale is checked against golden/exp_target_diff_{scale}x.csv when that file exists.
+'''
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from benchmark.synthetic import TARGET_SIZE, make_target_frame, write_campaign
+from common.curve_distance import distance_matrix, get_target_curves, nearest_target
+from common.ingest import ingest_dirs
+from common.peak_features import get_peak_features, get_target_peaks
+from common.spectral_store import SpectralStore
+from common.target_matching import calculate_peak_diff, get_near_wave
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+SIZE_COLS = ['day', 'wave', 'size', 'peak_size']
+VALUE_COLS = ['wave_error', 'peak_error', 'peak_source', 'peak_target']
+
+
+def timed(timings, stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    ret = func(*args, **kwargs)
+    timings[stage] = time.perf_counter() - start
+    return ret
+
+
+def run_scale(path, scale):
+    '''
+        Run every stage on a fresh campaign; returns (timings, n_wells, exp_target_diff)
+    '''
+    timings = {}
+    dir_list = timed(timings, 'write campaign', write_campaign, f'{path}/data', scale)
+    cache_dir = f'{path}/cache'
+    ingest = timed(timings, 'ingest (cold)', ingest_dirs, dir_list, cache_dir=cache_dir)
+    if ingest.failures:
+        raise RuntimeError(f'synthetic files failed to parse: {ingest.failures[:3]}')
+    timed(timings, 'ingest (cached)', ingest_dirs, dir_list, cache_dir=cache_dir)
+    spectral_store = timed(timings, 'store build', SpectralStore.build, f'{cache_dir}/spectra', ingest.wave_name_dict)
+
+    data_target = make_target_frame()
+    wave_cols = [col for col in data_target.columns if '波长' in col]
+    absor_cols = [col for col in data_target.columns if '吸光度' in col]
+    target_curves = get_target_curves(data_target, wave_cols, absor_cols, spectral_store.wavelength)
+    target_peaks = get_target_peaks(data_target, wave_cols, absor_cols)
+
+    timed(timings, 'distance', lambda: nearest_target(distance_matrix(spectral_store.matrix, target_curves)))
+    timed(timings, 'peak diff', lambda: calculate_peak_diff(
+        get_peak_features(spectral_store.wavelength, spectral_store.matrix), target_peaks))
+    exp_target_diff = timed(timings, 'get_near_wave', get_near_wave, spectral_store, np.arange(len(spectral_store)),
+                            target_curves, TARGET_SIZE, target_peaks)
+    return timings, len(spectral_store), exp_target_diff
+
+
+def compare_golden(exp_target_diff, golden):
+    # Differences that matter: a changed size assignment, or an error beyond float noise
+    problems = []
+    if len(exp_target_diff) != len(golden):
+        return [f'{len(exp_target_diff)} rows, golden has {len(golden)}']
+    for col in SIZE_COLS:
+        mismatch = (exp_target_diff[col].astype(str).values != golden[col].astype(str).values).sum()
+        if mismatch:
+            problems.append(f'{col}: {mismatch} rows differ')
+    for col in VALUE_COLS:
+        close = np.isclose(exp_target_diff[col].values.astype(float), golden[col].values.astype(float),
+                           rtol=1e-6, atol=1e-9, equal_nan=True)
+        if not close.all():
+            problems.append(f'{col}: {(~close).sum()} rows differ')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--update-golden', action='store_true', help='overwrite the golden tables of these scales')
+    parser.add_argument('--keep', help='write the campaigns under this folder instead of a temporary one')
+    args = parser.parse_args()
+
+    root = args.keep or tempfile.mkdtemp(prefix='astar_bench_')
+    failed = False
+    rows = []
+    try:
+        for scale in args.scales:
+            path = f'{root}/{scale}x'
+            shutil.rmtree(path, ignore_errors=True)
+            timings, n_wells, exp_target_diff = run_scale(path, scale)
+            for stage, seconds in timings.items():
+                rows.append({'scale': f'{scale}x', 'stage': stage, 'wells': n_wells, 'seconds': round(seconds, 4),
+                             'wells/s': round(n_wells / seconds) if seconds > 0 else np.inf})
+
+            golden_path = f'{GOLDEN_DIR}/exp_target_diff_{scale}x.csv'
+            if args.update_golden:
+                os.makedirs(GOLDEN_DIR, exist_ok=True)
+                exp_target_diff.to_csv(golden_path, index=False, float_format='%.10g')
+                print(f'{scale}x: golden written to {golden_path}')
+            elif os.path.exists(golden_path):
+                problems = compare_golden(exp_target_diff, pd.read_csv(golden_path))
+                failed |= bool(problems)
+                print(f'{scale}x: golden ' + ('FAILED ' + '; '.join(problems) if problems else 'ok'))
+            else:
+                print(f'{scale}x: no golden table')
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print(pd.DataFrame(rows).to_string(index=False))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+'''
+    Synthetic campaigns for the matching benchmark
+    Half of the plates are Epoch 2 plate-reader exports (UV-Vis_Data), half are normalized
+    spectrum workbooks (normalization), like the AuNRs and AuNSs data folders.
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.uv_vis import WAVE_COL
+
+# Plates of one campaign at 1x, with 12 measured wells each
+CAMPAIGN_PLATES = 20
+WELLS = [f'{row}{col}' for row in 'ABCDEFGH' for col in range(1, 13)]
+MEASURED_WELLS = WELLS[-12:]
+
+READER_WAVELENGTH = np.arange(400, 1000)
+NORMALIZED_WAVELENGTH = np.arange(400, 801)
+
+TARGET_PEAKS = [520, 560, 600, 650]
+TARGET_SIZE = ['24nm', '54nm', '69nm', '88nm']
+
+
+def gauss(wavelength, center, width):
+    return np.exp(-0.5 * ((wavelength - center) / width) ** 2)
+
+
+def make_curves(rng, wavelength, n_curves):
+    '''
+        (len(wavelength), n_curves) absorbance with one or two plasmon peaks, rounded like the reader
+    '''
+    center = rng.uniform(500, 700, n_curves)
+    width = rng.uniform(20, 60, n_curves)
+    second = rng.uniform(0, 0.6, n_curves) * (rng.random(n_curves) < 0.5)
+    curves = gauss(wavelength[:, None], center, width) + second * gauss(wavelength[:, None], center + 250, 40)
+    curves += 0.2 * np.exp(-(wavelength[:, None] - 400) / 150) + rng.normal(0, 0.002, curves.shape)
+    return np.round(curves, 3)
+
+
+def write_reader_file(path, curves):
+    lines = ['', '软件版本\t3.11.19', '', '读板类型\t96 WELL PLATE', '测量\t吸收光 光谱',
+             f'\t{MEASURED_WELLS[0]}..{MEASURED_WELLS[-1]}',
+             f'\t开始: {READER_WAVELENGTH[0]} nm,  停止: {READER_WAVELENGTH[-1]} nm,  步骤: 1 nm',
+             '', 'Spectrum', '', '\t'.join([WAVE_COL] + WELLS)]
+    pad = '\t' * (len(WELLS) - len(MEASURED_WELLS))
+    for wave, row in zip(READER_WAVELENGTH, curves):
+        lines.append(f'{wave}{pad}\t' + '\t'.join(f'{x:.3f}' for x in row))
+    lines += ['', '结果']
+    with open(path, 'w', encoding='gbk', newline='\r\n') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def write_campaign(path, scale, seed=0):
+    '''
+        Write a campaign of scale * CAMPAIGN_PLATES plates under path and return its folders
+    '''
+    rng = np.random.default_rng([seed, scale])
+    reader_dir = f'{path}/UV-Vis_Data'
+    normalized_dir = f'{path}/normalization'
+    os.makedirs(reader_dir, exist_ok=True)
+    os.makedirs(normalized_dir, exist_ok=True)
+    for i in range(scale * CAMPAIGN_PLATES):
+        day = f'2024{i // 2:04d}'
+        if i % 2 == 0:
+            write_reader_file(f'{reader_dir}/{day}-1.txt', make_curves(rng, READER_WAVELENGTH, len(MEASURED_WELLS)))
+        else:
+            data = pd.DataFrame(make_curves(rng, NORMALIZED_WAVELENGTH, len(MEASURED_WELLS)), columns=MEASURED_WELLS)
+            data.insert(0, WAVE_COL, NORMALIZED_WAVELENGTH)
+            data.to_excel(f'{normalized_dir}/小尺寸AuNSs-{day}-2.xlsx', index=False)
+    return [reader_dir, normalized_dir]
+
+
+def make_target_frame():
+    # Target workbook layout: one 波长/吸光度 column pair per target size
+    data = {}
+    for i, center in enumerate(TARGET_PEAKS):
+        suffix = '' if i == 0 else f'.{i}'
+        data[f'波长{suffix}'] = NORMALIZED_WAVELENGTH
+        data[f'吸光度{suffix}'] = np.round(gauss(NORMALIZED_WAVELENGTH, center, 40)
+                                          + 0.2 * np.exp(-(NORMALIZED_WAVELENGTH - 400) / 150), 3)
+    return pd.DataFrame(data)
@@ -0,0 +1,3 @@
+'''
+    Shared helpers for the AgNCs, AuNSs and AuNRs A* scripts
+'''
@@ -0,0 +1,627 @@
+'''
+    A* optimizer shared by the AgNCs, AuNSs and AuNRs scripts
+    Objectives map a measured column to the valuation zi (higher is better). TableSearch runs the
+    simulated AuNRs campaigns over a candidate table with its state in NumPy arrays;
+    build_closed_set / build_open_set propose the next formulas from finished experiments, keyed on
+    the ParamGrid lattice of their parameters.
+'''
+import hashlib
+import heapq
+from collections import namedtuple
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from common.checkpoint import from_json_array, load_checkpoint, save_checkpoint, to_json_array
+from common.surrogate import predict
+
+# si of the starting points, which are never updated by their neighbours
+DEFAULT_VALUE = 20
+
+STATE_COLS = ['is_close', 'is_open', 'zi', 'sn', 'si', 'si_ucb', 'step']
+# Arrays of a TableSearch checkpoint, besides the open heap, the front and the generator state
+CHECKPOINT_ARRAYS = STATE_COLS + ['si_obj', 'plate_weights', 'start_rows']
+
+
+def lspr_zi(x, target, MAX_PEAK_WAVE=1000):
+    return 1.0 - (1.0 * np.abs(x - target) / MAX_PEAK_WAVE)
+
+
+def peak_ratio_zi(x, target=None, MAX_VALUE=4.0):
+    return x / MAX_VALUE
+
+
+def fwhm_zi(x, target=None, MAX_VALUE=200):
+    return 1.0 - (x / MAX_VALUE)
+
+
+def curve_error_zi(x, target=None, MAX_VALUE=1):
+    return 1.0 - (x / MAX_VALUE)
+
+
+def peak_error_zi(x, target=7.0, MAX_VALUE=50):
+    # Closest to the target peak error
+    return 1 - (np.abs(x - target) / MAX_VALUE)
+
+
+def ucb1(si, sn, step, alpha, rng):
+    return si + alpha * np.sqrt(2.0 * np.log(step) / sn)
+
+
+def decaying_ucb(si, sn, step, alpha, rng):
+    # The exploration bonus shrinks as the campaign goes on
+    return si + alpha / np.sqrt(step) * np.sqrt(2.0 * np.log(step) / sn)
+
+
+def thompson(si, sn, step, alpha, rng):
+    # One draw around the running mean, narrower for rows updated more often
+    return rng.normal(si, alpha / np.sqrt(sn))
+
+
+# Acquisition rules: si_ucb of the open rows from their si and sn at a step
+ACQUISITIONS = {
+    'ucb1': ucb1,
+    'decaying_ucb': decaying_ucb,
+    'thompson': thompson,
+}
+
+Objective = namedtuple('Objective', ['column', 'func'])
+
+OBJECTIVES = {
+    'lspr': Objective('2nd_peak_wave', lspr_zi),
+    'peak_ratio': Objective('2nd_peak_ratio', peak_ratio_zi),
+    'fwhm': Objective('2nd_peak_width', fwhm_zi),
+    'curve_error': Objective('wave_error', curve_error_zi),
+    'peak_error': Objective('peak_error', peak_error_zi),
+}
+
+
+def weighted_sum(values, weights):
+    return values @ weights
+
+
+def chebyshev(values, weights, rho=0.05):
+    # Augmented Chebyshev: the worst weighted objective, plus a small share of the sum so that
+    # weakly dominated rows lose their ties
+    weighted = values * weights
+    return weighted.min(axis=1) + rho * weighted.sum(axis=1)
+
+
+# Scalarizations of the per-objective si: a fixed weighted sum, or a Chebyshev scalarization
+# whose weights are redrawn for every plate so the campaign spreads over the Pareto front
+SCALARIZATIONS = {
+    'weighted': weighted_sum,
+    'pareto': chebyshev,
+}
+
+def get_zi(objective, data, target=None):
+    '''
+        zi of every row of data, target=None keeps the default target of the objective
+    '''
+    column, func = OBJECTIVES[objective]
+    x = data[column].values.astype(float)
+    return func(x) if target is None else func(x, target)
+
+
+class OpenHeap:
+    '''
+        Max-heap of the open rows on their score, ties in row order
+        Entries are never removed in place: a row that is closed or gets a new score bumps its
+        version, and pop skips the entries of older versions. When most of the rows get a new
+        score at once the heap is rebuilt instead of growing by one entry per row.
+    '''
+
+    def __init__(self, n):
+        self.heap = []
+        self.version = np.zeros(n, dtype=np.int64)
+        self.score = np.full(n, np.nan)
+
+    def __len__(self):
+        return int((~np.isnan(self.score)).sum())
+
+    def push(self, rows, scores):
+        rows = np.atleast_1d(rows)
+        self.version[rows] += 1
+        self.score[rows] = scores
+        if len(rows) > len(self.heap) // 2:
+            self.rebuild()
+            return
+        for row, score, version in zip(rows.tolist(), np.atleast_1d(scores).tolist(), self.version[rows].tolist()):
+            heapq.heappush(self.heap, (-score, row, version))
+
+    def remove(self, rows):
+        self.version[rows] += 1
+        self.score[rows] = np.nan
+
+    def rebuild(self):
+        rows = np.flatnonzero(~np.isnan(self.score))
+        self.heap = list(zip((-self.score[rows]).tolist(), rows.tolist(), self.version[rows].tolist()))
+        heapq.heapify(self.heap)
+
+    def pop(self, topk=1):
+        # Rows with the largest scores, which leave the heap
+        rows = []
+        while self.heap and len(rows) < topk:
+            _, row, version = heapq.heappop(self.heap)
+            if version == self.version[row]:
+                rows.append(row)
+        self.remove(rows)
+        return np.array(rows, dtype=int)
+
+
+class ParetoFront:
+    '''
+        Rows not dominated on any of m objectives (higher is better), kept as rows are added
+        A row equal to one on the front is not added, rows with a NaN objective are skipped.
+    '''
+
+    def __init__(self, m):
+        self.rows = np.zeros(0, dtype=int)
+        self.values = np.zeros((0, m))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, rows, values):
+        for row, value in zip(np.atleast_1d(rows), np.atleast_2d(values)):
+            if np.isnan(value).any() or (self.values >= value).all(axis=1).any():
+                continue
+            keep = ~(value >= self.values).all(axis=1)
+            self.rows = np.append(self.rows[keep], row)
+            self.values = np.vstack([self.values[keep], value])
+
+
+# Compressed sparse rows: the neighbours of row i are indices[indptr[i]:indptr[i + 1]]
+NeighbourGraph = namedtuple('NeighbourGraph', ['indptr', 'indices'])
+
+
+def build_neighbour_graph(data, cols, thres):
+    '''
+        NeighbourGraph of the rows whose cols all differ by less than thres, nearest first
+        Distance is the largest difference relative to thres, ties in row order. Candidate pairs
+        come from a sorted window on the first column, so the table order does not matter.
+    '''
+    values = data[list(cols)].values.astype(float)
+    thres = np.asarray(thres, dtype=float)
+    n = len(values)
+    order = np.argsort(values[:, 0], kind='stable')
+    first = values[order, 0]
+    # The window keeps its edges, the distance test alone decides pairs right at the threshold
+    start = np.searchsorted(first, first - thres[0], side='left')
+    stop = np.searchsorted(first, first + thres[0], side='right')
+    counts = stop - start
+    rows = np.repeat(order, counts)
+    others = order[np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+
+    distance = (np.abs(values[others] - values[rows]) / thres).max(axis=1)
+    keep = (distance < 1) & (others != rows)
+    rows, others, distance = rows[keep], others[keep], distance[keep]
+    pairs = np.lexsort((others, distance, rows))
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))])
+    return NeighbourGraph(indptr, others[pairs])
+
+
+class TableSearch:
+    '''
+        A* over the rows of a candidate table whose results are already measured
+        Neighbours come from a NeighbourGraph built once for the table, so every target and
+        restart shares it. The open rows are kept in an OpenHeap on col (si or si_ucb), where
+        si_ucb comes from one of the ACQUISITIONS rules.
+        objective may be a list of OBJECTIVES scored in the same pass: every objective keeps its
+        own running mean in si_obj over the shared neighbours and sn, and si is their
+        scalarization (see SCALARIZATIONS). The closed rows not dominated on zi are kept in front.
+        With a Surrogate, si_ucb of the open rows reached through the graph is blended with the
+        upper bound of its prediction from the closed rows (see Surrogate.weight).
+    '''
+
+    def __init__(self, data, objective, graph, target=None, col='si_ucb', acquisition='ucb1', alpha=0.1,
+                 mode='weighted', weights=None, surrogate=None):
+        self.data = data
+        self.surrogate = surrogate
+        if surrogate is not None:
+            self.features = data[list(surrogate.cols)].values.astype(float)
+        self.col = col
+        self.acquisition = acquisition
+        self.alpha = alpha
+        self.mode = mode
+        self.target = target
+        self.rng = np.random.default_rng()
+        self.graph = graph
+        self.objectives = [objective] if isinstance(objective, str) else list(objective)
+        # Stop rules look at the measured column of the first objective
+        self.result = data[OBJECTIVES[self.objectives[0]].column].values.astype(float)
+        self.zi_all = np.column_stack([get_zi(o, data, target) for o in self.objectives])
+        weights = np.ones(len(self.objectives)) if weights is None else np.asarray(weights, dtype=float)
+        self.weights = weights / weights.sum()
+        self.table_hash = None
+        self.reset()
+
+    def __len__(self):
+        return len(self.result)
+
+    def reset(self):
+        n = len(self)
+        self.is_open = np.zeros(n, dtype=bool)
+        self.is_close = np.zeros(n, dtype=bool)
+        self.zi = np.zeros(n)
+        self.sn = np.zeros(n, dtype=int)
+        self.si = np.zeros(n)
+        self.si_obj = np.zeros((n, len(self.objectives)))
+        self.si_ucb = np.zeros(n)
+        self.step = np.full(n, -1)
+        self.open_heap = OpenHeap(n)
+        self.front = ParetoFront(len(self.objectives))
+        self.plate_weights = self.weights
+        self.start_rows = np.zeros(0, dtype=int)
+
+    def start(self, rows):
+        # Starting points go to the open set with the default valuation
+        self.start_rows = np.asarray(rows, dtype=int)
+        self.is_open[rows] = True
+        self.si[rows] = DEFAULT_VALUE
+        self.si_ucb[rows] = DEFAULT_VALUE
+        self.open_heap.push(rows, getattr(self, self.col)[rows])
+
+    def select(self, topk=1, penalty=0.0):
+        '''
+            The topk open rows with the largest score, ties in table order
+            With penalty, each row picked for the batch lowers the score of its graph neighbours by
+            penalty, so a plate spreads over several neighbourhoods. Penalties only lower scores, so
+            a popped row is re-pushed once with its penalized score before it can be picked.
+        '''
+        if topk == 1 or penalty == 0:
+            return self.open_heap.pop(topk)
+        score = getattr(self, self.col)
+        hits = np.zeros(len(self), dtype=int)
+        applied = np.zeros(len(self), dtype=int)
+        picked = []
+        while len(picked) < topk:
+            rows = self.open_heap.pop(1)
+            if not len(rows):
+                break
+            row = rows[0]
+            if hits[row] != applied[row]:
+                applied[row] = hits[row]
+                self.open_heap.push(row, score[row] - penalty * hits[row])
+                continue
+            picked.append(row)
+            hits[self.neighbours(row)] += 1
+        # Penalized rows left in the open set get their own score back
+        penalized = np.flatnonzero((applied > 0) & ~np.isnan(self.open_heap.score))
+        if len(penalized):
+            self.open_heap.push(penalized, score[penalized])
+        return np.array(picked, dtype=int)
+
+    def observe(self, rows, step):
+        # Run the experiments of rows: they move to the closed set and get their zi
+        self.is_open[rows] = False
+        self.is_close[rows] = True
+        self.open_heap.remove(rows)
+        self.step[rows] = step
+        self.zi[rows] = self.zi_all[rows] @ self.weights
+        self.front.add(rows, self.zi_all[rows])
+        return self.result[rows]
+
+    def neighbours(self, row):
+        return self.graph.indices[self.graph.indptr[row]:self.graph.indptr[row + 1]]
+
+    def update(self, rows, ch_zi):
+        # Running mean of the zi of the chosen neighbours; starting points keep their default value
+        rows = rows[self.si_ucb[rows] != DEFAULT_VALUE]
+        self.is_open[rows] = True
+        sn = self.sn[rows, None]
+        self.si_obj[rows] = (self.si_obj[rows] * sn + ch_zi) / (sn + 1)
+        self.si[rows] = SCALARIZATIONS[self.mode](self.si_obj[rows], self.plate_weights)
+        self.sn[rows] += 1
+        if self.col == 'si':
+            self.open_heap.push(rows, self.si[rows])
+
+    def update_neighbours(self, rows, step, delta_cnt=10):
+        # The delta_cnt nearest unvisited neighbours of every chosen row take its zi
+        for ch in rows:
+            neighbours = self.neighbours(ch)
+            self.update(neighbours[~self.is_close[neighbours]][:delta_cnt], self.zi_all[ch])
+        self.update_ucb(step)
+
+    def update_ucb(self, step):
+        # Every open row that is not a starting point is rescored in one call
+        rows = np.flatnonzero(self.is_open & (self.si_ucb != DEFAULT_VALUE))
+        if self.mode == 'pareto':
+            # A new direction on the front for every plate
+            self.plate_weights = self.rng.dirichlet(np.ones(len(self.objectives)))
+            self.si[rows] = SCALARIZATIONS[self.mode](self.si_obj[rows], self.plate_weights)
+            if self.col == 'si':
+                self.open_heap.push(rows, self.si[rows])
+        self.si_ucb[rows] = ACQUISITIONS[self.acquisition](self.si[rows], self.sn[rows], step, self.alpha, self.rng)
+        if self.surrogate is not None and len(rows):
+            closed = np.flatnonzero(self.is_close)
+            mean, std = predict(self.surrogate, self.features[closed], self.zi[closed], self.features[rows])
+            weight = self.surrogate.weight
+            self.si_ucb[rows] = (1 - weight) * self.si_ucb[rows] + weight * (mean + self.surrogate.kappa * std)
+        if self.col == 'si_ucb':
+            self.open_heap.push(rows, self.si_ucb[rows])
+
+    def get_table_hash(self):
+        # Hash of the candidate table and its neighbour graph, computed once
+        if self.table_hash is None:
+            h = hashlib.sha1(pd.util.hash_pandas_object(self.data).values.tobytes())
+            h.update('|'.join(map(str, self.data.columns)).encode('utf-8'))
+            h.update(np.ascontiguousarray(self.graph.indptr, dtype=np.int64).tobytes())
+            h.update(np.ascontiguousarray(self.graph.indices, dtype=np.int64).tobytes())
+            self.table_hash = h.hexdigest()
+        return self.table_hash
+
+    def same_table(self, state):
+        # Whether state() was taken on this table and neighbour graph
+        return len(state['is_open']) == len(self) and state['table'].item() == self.get_table_hash()
+
+    def campaign(self, delta_cnt=10, batch_size=1, penalty=0.05):
+        # Settings a checkpoint must share with the campaign that resumes from it
+        return {'objectives': self.objectives, 'target': None if self.target is None else float(self.target),
+                'weights': self.weights.tolist(), 'mode': self.mode, 'col': self.col,
+                'acquisition': self.acquisition, 'delta_cnt': int(delta_cnt), 'batch_size': int(batch_size),
+                'penalty': float(penalty)}
+
+    def state(self, step, reached=False, delta_cnt=10, batch_size=1, penalty=0.05):
+        # Arrays of a checkpoint taken before plate step
+        state = {col: getattr(self, col) for col in CHECKPOINT_ARRAYS}
+        state.update(table=np.array(self.get_table_hash()),
+                     campaign=to_json_array(self.campaign(delta_cnt, batch_size, penalty)),
+                     heap_score=self.open_heap.score, front_rows=self.front.rows, front_values=self.front.values,
+                     rng=to_json_array(self.rng.bit_generator.state), next_step=step, reached=reached)
+        return state
+
+    def restore(self, state, start_rows=None, delta_cnt=10, batch_size=1, penalty=0.05):
+        '''
+            Resume from state(); returns (next step, whether stop was reached)
+            The checkpoint must come from the same table and neighbour graph, campaign settings and
+            start_rows (when given), or ValueError is raised. The open heap is rebuilt from the saved
+            scores, which pops in the same order.
+        '''
+        if not self.same_table(state):
+            raise ValueError('the checkpoint was taken on another table')
+        saved = from_json_array(state['campaign'])
+        if saved != self.campaign(delta_cnt, batch_size, penalty):
+            raise ValueError(f'the checkpoint was taken on another campaign: {saved}')
+        if start_rows is not None and not np.array_equal(state['start_rows'], np.asarray(start_rows, dtype=int)):
+            raise ValueError('the checkpoint was taken from other starting rows')
+        for col in CHECKPOINT_ARRAYS:
+            setattr(self, col, state[col].copy())
+        self.open_heap = OpenHeap(len(self))
+        self.open_heap.score = state['heap_score'].copy()
+        self.open_heap.rebuild()
+        self.front = ParetoFront(len(self.objectives))
+        self.front.rows, self.front.values = state['front_rows'].copy(), state['front_values'].copy()
+        self.rng.bit_generator.state = from_json_array(state['rng'])
+        return int(state['next_step']), bool(state['reached'])
+
+    def run(self, start_rows, max_step, delta_cnt=10, stop=None, rng=None, acquisition=None, batch_size=1,
+            penalty=0.05, checkpoint=None):
+        '''
+            One campaign from start_rows; returns (last step, whether stop was reached)
+            stop(results) -> bool ends the campaign once an experiment hits the target, results
+            being the measured column of the first objective.
+            rng seeds the sampling acquisition rules, acquisition overrides the rule of the search.
+            Every step runs a plate of batch_size experiments (see select) and updates the scores once.
+            With a checkpoint path the state is saved after every plate, and a campaign that finds
+            a checkpoint of the same campaign there resumes from it (see restore). A checkpoint
+            taken on another table, e.g. before the feature table was rebuilt, is out of date and
+            the campaign starts over.
+        '''
+        if rng is not None:
+            self.rng = rng
+        if acquisition is not None:
+            self.acquisition = acquisition
+        state = load_checkpoint(checkpoint) if checkpoint is not None else None
+        if state is not None and not self.same_table(state):
+            state = None
+        if state is None:
+            self.reset()
+            self.start(start_rows)
+            step = 1
+        else:
+            step, reached = self.restore(state, start_rows, delta_cnt, batch_size, penalty)
+            if reached:
+                return step, True
+        while step < max_step and self.is_open.any():
+            rows = self.select(batch_size, penalty)
+            results = self.observe(rows, step)
+            if stop is not None and stop(results):
+                if checkpoint is not None:
+                    save_checkpoint(checkpoint, **self.state(step, True, delta_cnt, batch_size, penalty))
+                return step, True
+            self.update_neighbours(rows, step, delta_cnt)
+            step += 1
+            if checkpoint is not None:
+                save_checkpoint(checkpoint, **self.state(step, False, delta_cnt, batch_size, penalty))
+        return step, False
+
+    def frame(self):
+        # The candidate table with the search state columns, per objective when there are several
+        data = self.data.copy()
+        for col in STATE_COLS:
+            values = getattr(self, col)
+            data[col] = values.astype(int) if values.dtype == bool else values
+        if len(self.objectives) > 1:
+            for i, objective in enumerate(self.objectives):
+                data[f'zi_{objective}'] = np.where(self.is_close, self.zi_all[:, i], 0.0)
+                data[f'si_{objective}'] = self.si_obj[:, i]
+            data['pareto'] = np.isin(np.arange(len(self)), self.front.rows).astype(int)
+        return data
+
+    def closed_frame(self):
+        # Experiments of the campaign in the order they were run
+        data = self.frame()
+        return data[self.is_close].sort_values(by='step', ascending=True)
+
+    def front_frame(self):
+        # Experiments on the Pareto front of the campaign in the order they were run
+        data = self.frame()
+        return data.iloc[self.front.rows].sort_values(by='step', ascending=True)
+
+
+class ParamGrid:
+    '''
+        Integer lattice of the formula parameters at the dispense resolution of each one
+        A formula is a row of int64 grid steps, so equal formulas compare equal however their
+        values were summed, whatever the number of parameters or their magnitude.
+    '''
+
+    def __init__(self, resolution):
+        self.resolution = np.asarray(resolution, dtype=float)
+        self.scale = 1.0 / self.resolution
+
+    def to_lattice(self, values):
+        return np.rint(np.asarray(values, dtype=float) * self.scale).astype(np.int64)
+
+    def to_values(self, lattice):
+        return np.asarray(lattice) / self.scale
+
+    def steps(self, gap):
+        # Parameter gaps in grid steps
+        return np.rint(np.asarray(gap, dtype=float) * self.scale).astype(np.int64)
+
+
+# Formulas on a ParamGrid: (n, d) grid steps, one row per formula, and the zi list of each one
+LatticeSet = namedtuple('LatticeSet', ['lattice', 'zi'])
+
+
+def lattice_set_state(name, lattice_set):
+    # Checkpoint arrays of a LatticeSet, the zi lists flattened with their lengths
+    return {f'{name}_lattice': lattice_set.lattice,
+            f'{name}_zi': np.fromiter(chain.from_iterable(lattice_set.zi), dtype=float),
+            f'{name}_zi_len': np.fromiter(map(len, lattice_set.zi), dtype=np.int64, count=len(lattice_set.zi))}
+
+
+def restore_lattice_set(state, name):
+    flat = state[f'{name}_zi'].tolist()
+    stops = np.cumsum(state[f'{name}_zi_len']).tolist()
+    zi = [flat[start:stop] for start, stop in zip([0] + stops[:-1], stops)]
+    return LatticeSet(state[f'{name}_lattice'], zi)
+
+
+def row_keys(rows):
+    # One fixed-width byte key per (n, d) lattice row, equal exactly when the rows are
+    rows = np.ascontiguousarray(rows, dtype=np.int64)
+    return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[-1]))).reshape(rows.shape[:-1])
+
+
+def find_rows(lattice, query):
+    # Position of every query row in lattice (rows without duplicates), -1 where it is missing
+    query = np.asarray(query, dtype=np.int64)
+    if len(lattice) == 0:
+        return np.full(query.shape[:-1], -1)
+    keys, query = row_keys(lattice), row_keys(query)
+    order = np.argsort(keys, kind='stable')
+    pos = np.minimum(np.searchsorted(keys[order], query), len(keys) - 1)
+    return np.where(keys[order][pos] == query, order[pos], -1)
+
+
+def axis_offsets(gap_steps, thres_steps):
+    '''
+        Lattice offsets of k * gap along one parameter at a time, for k = 1 .. thres // gap
+        Returns (offsets, run, axis): offsets in (parameter, +/-, k) order, the index of the
+        (parameter, direction) run of each one, and the parameter it moves.
+    '''
+    offsets, run, axis = [], [], []
+    for idx, (gap, thres) in enumerate(zip(gap_steps, thres_steps)):
+        steps = gap * np.arange(1, thres // gap + 1) if gap > 0 else np.zeros(0, dtype=np.int64)
+        for i, sign in enumerate((1, -1)):
+            block = np.zeros((len(steps), len(gap_steps)), dtype=np.int64)
+            block[:, idx] = sign * steps
+            offsets.append(block)
+            run += [2 * idx + i] * len(steps)
+            axis += [idx] * len(steps)
+    return np.concatenate(offsets), np.array(run, dtype=int), np.array(axis, dtype=int)
+
+
+def gather_zi(zi, sources, targets, n_targets):
+    # zi lists of every target, the lists of its sources concatenated in source order
+    order = np.argsort(targets, kind='stable')
+    sources, targets = sources[order], targets[order]
+    lengths = np.fromiter(map(len, zi), dtype=np.int64, count=len(zi))
+    flat = np.fromiter(chain.from_iterable(zi), dtype=float, count=lengths.sum())
+    starts = np.cumsum(lengths) - lengths
+    counts = lengths[sources]
+    # Indices into flat of each (source, target) pair, one run of the source zi per pair
+    idx = np.repeat(starts[sources] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    ptr = np.concatenate([[0], np.cumsum(np.bincount(targets, weights=counts, minlength=n_targets))]).astype(int)
+    flat = flat[idx].tolist()
+    return [flat[start:stop] for start, stop in zip(ptr[:-1].tolist(), ptr[1:].tolist())]
+
+
+def build_closed_set(data, params, zi, grid):
+    '''
+        LatticeSet of the finished experiments, in order of first appearance
+        Rows with a NaN zi are skipped.
+    '''
+    valid = ~np.isnan(zi)
+    lattice = grid.to_lattice(data[params].values[valid]).reshape(-1, len(params))
+    zi = np.asarray(zi, dtype=float)[valid]
+    unique, first, inverse = np.unique(row_keys(lattice), return_index=True, return_inverse=True)
+    # Group the zi of every formula with one sort instead of a dict lookup per row
+    order = np.argsort(inverse, kind='stable')
+    groups = np.split(zi[order], np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1])
+    first_order = np.argsort(first)
+    return LatticeSet(lattice[first[first_order]], [groups[i].tolist() for i in first_order])
+
+
+def build_open_set(closed_set, grid, params_gap, params_thres, cnt_limit, near_gap=None, near_thres=None,
+                   positive=False):
+    '''
+        LatticeSet of the unvisited formulas next to the closed set
+        Every closed formula is stepped by params_gap along one parameter at a time, up to cnt_limit
+        unvisited formulas per direction within params_thres. Without near_gap the new formulas take
+        the zi of the formulas they came from; with it, they take the zi of every closed formula
+        within near_thres of them on a near_gap grid. positive drops formulas with a parameter <= 0.
+        All candidates are generated at once as (closed formulas, offsets, parameters) lattice rows
+        and looked up by row, so the result does not depend on the order of the closed formulas.
+        This differs from the original per-formula loops in two ways:
+        - cnt_limit counts every unvisited formula of a run, also one an earlier closed formula
+          already opened. The loops counted only the formulas they opened themselves, so a run
+          across open formulas went further. Both agree while params_thres // params_gap <= cnt_limit,
+          as in the AgNCs and AuNSs scripts.
+        - Near-grid zi reaches every open formula within near_thres. The loops added it during the
+          expansion, so only formulas opened by then received it.
+    '''
+    lattice = closed_set.lattice
+    offsets, run, axis = axis_offsets(grid.steps(params_gap), grid.steps(params_thres))
+    candidates = lattice[:, None] + offsets
+    valid = find_rows(lattice, candidates) < 0
+    if positive:
+        valid &= lattice[:, axis] + offsets[np.arange(len(offsets)), axis] > 0
+    # Only the first cnt_limit unvisited steps of every (parameter, direction) run count
+    count = np.concatenate([np.zeros((len(lattice), 1), dtype=np.int64), np.cumsum(valid, axis=1)], axis=1)
+    valid &= count[:, 1:] - count[:, np.searchsorted(run, run)] <= cnt_limit
+
+    source, offset = np.nonzero(valid)
+    _, first, target = np.unique(row_keys(candidates[source, offset]), return_index=True, return_inverse=True)
+    # Open formulas in order of first appearance, as if the closed formulas were expanded one by one
+    first_order = np.argsort(first)
+    target = np.argsort(first_order)[target]
+    open_lattice = candidates[source[first[first_order]], offset[first[first_order]]]
+
+    if near_gap is None:
+        zi = gather_zi(closed_set.zi, source, target, len(open_lattice))
+    else:
+        near_offsets, _, _ = axis_offsets(grid.steps(near_gap), grid.steps(near_thres))
+        near = find_rows(open_lattice, lattice[:, None] + near_offsets)
+        source, offset = np.nonzero(near >= 0)
+        zi = gather_zi(closed_set.zi, source, near[source, offset], len(open_lattice))
+    return LatticeSet(open_lattice, zi)
+
+
+def open_set_frame(open_set, params, grid):
+    '''
+        Proposed formulas with their si (mean zi), near_num and near_zi, best first
+    '''
+    ret = pd.DataFrame(grid.to_values(open_set.lattice.reshape(-1, len(params))), columns=params)
+    near_num = np.fromiter(map(len, open_set.zi), dtype=np.int64, count=len(open_set.zi))
+    flat = np.fromiter(chain.from_iterable(open_set.zi), dtype=float, count=near_num.sum())
+    zi_sum = np.bincount(np.repeat(np.arange(len(near_num)), near_num), weights=flat, minlength=len(near_num))
+    with np.errstate(invalid='ignore'):
+        ret['si'] = zi_sum / near_num
+    ret['near_num'] = near_num
+    ret['near_zi'] = open_set.zi
+    return ret.sort_values(by='si', ascending=False)
@@ -0,0 +1,42 @@
+'''
+    Atomic checkpoints of optimizer state
+    A checkpoint is one uncompressed .npz of named arrays, written to a temporary file, synced
+    to disk and renamed over the previous one, so a crash leaves either the old or the new
+    snapshot and never a partial one. Loading reads the arrays back without pickles.
+'''
+import json
+import os
+
+import numpy as np
+
+from common.file_cache import write_atomic
+
+
+def save_checkpoint(path, **arrays):
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    write_atomic(path, write)
+
+
+def load_checkpoint(path):
+    '''
+        Arrays of the checkpoint at path, None when there is none yet
+    '''
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def to_json_array(value):
+    # Small structures such as a bit generator state, kept as one string array
+    return np.array(json.dumps(value))
+
+
+def from_json_array(array):
+    return json.loads(array.item())
@@ -0,0 +1,74 @@
+'''
+    Curve distances on a shared wavelength grid
+    Curves are rows of a (n_curves, len(grid)) matrix with NaN where a curve was not measured.
+    The distance between two curves is the mean squared difference over the grid points both cover.
+'''
+import numpy as np
+
+CHUNK_ROWS = 4096
+
+
+def resample(wavelength, values, grid):
+    '''
+        Linearly interpolate curves sampled at wavelength onto grid
+        values is (len(wavelength), n_curves); the result is (n_curves, len(grid)), NaN outside the measured range
+    '''
+    wavelength = np.asarray(wavelength, dtype=float)
+    values = np.asarray(values, dtype=float).reshape(len(wavelength), -1)
+    order = np.argsort(wavelength, kind='stable')
+    wavelength = wavelength[order]
+    values = values[order]
+    ret = np.full((values.shape[1], len(grid)), np.nan)
+    for col in range(values.shape[1]):
+        valid = ~np.isnan(values[:, col])
+        if valid.any():
+            ret[col] = np.interp(grid, wavelength[valid], values[valid, col], left=np.nan, right=np.nan)
+    return ret
+
+
+def get_target_curves(data_target, wave_cols, absor_cols, grid):
+    '''
+        Target curves of the normalized uv workbook, one row per (wave_col, absor_col) pair
+        Rows padded with 0 (shorter columns after fillna) are not part of a curve.
+    '''
+    curves = []
+    for wcol, acol in zip(wave_cols, absor_cols):
+        wavelength = data_target[wcol].astype(float).values
+        valid = wavelength > 0
+        curves.append(resample(wavelength[valid], data_target[acol].astype(float).values[valid], grid)[0])
+    return np.array(curves).reshape(len(curves), len(grid))
+
+
+def distance_matrix(sources, targets, chunk_rows=CHUNK_ROWS):
+    '''
+        (n_sources, n_targets) mean squared error between every source and every target curve
+        NaN where a pair shares no grid point.
+    '''
+    targets = np.asarray(targets, dtype=float)
+    t_mask = ~np.isnan(targets)
+    t_val = np.where(t_mask, targets, 0.0)
+    t_mask = t_mask.astype(float)
+
+    ret = np.empty((len(sources), len(targets)))
+    for start in range(0, len(sources), chunk_rows):
+        chunk = np.asarray(sources[start:start + chunk_rows], dtype=float)
+        s_mask = ~np.isnan(chunk)
+        s_val = np.where(s_mask, chunk, 0.0)
+        s_mask = s_mask.astype(float)
+
+        # sum over shared points of (s - t)^2 = s^2 - 2st + t^2, each term masked to the shared points
+        sq_sum = (s_val ** 2) @ t_mask.T - 2.0 * s_val @ t_val.T + s_mask @ (t_val ** 2).T
+        count = s_mask @ t_mask.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ret[start:start + len(chunk)] = np.where(count > 0, np.maximum(sq_sum, 0.0) / count, np.nan)
+    return ret
+
+
+def nearest_target(distance):
+    '''
+        Index and error of the closest target for every source row of a distance matrix
+        The error is NaN when a source shares no grid point with any target.
+    '''
+    min_idx = np.argmin(np.where(np.isnan(distance), np.inf, distance), axis=1)
+    min_error = distance[np.arange(len(distance)), min_idx]
+    return min_idx, min_error
@@ -0,0 +1,33 @@
+'''
+    Sorted index over one feature column for range queries
+    Rows are kept in feature order, so the rows inside or outside a window are found with two
+    binary searches and returned without scanning the table.
+'''
+import numpy as np
+
+
+class FeatureIndex:
+
+    def __init__(self, values, labels=None):
+        values = np.asarray(values, dtype=float)
+        labels = np.arange(len(values)) if labels is None else np.asarray(labels)
+        # Rows without the feature (NaN) are never part of a window
+        valid = ~np.isnan(values)
+        order = np.argsort(values[valid], kind='stable')
+        self.values = values[valid][order]
+        self.labels = labels[valid][order]
+
+    def __len__(self):
+        return len(self.values)
+
+    def between(self, lo, hi):
+        # Labels of the rows with lo < value < hi, in feature order
+        start = np.searchsorted(self.values, lo, side='right')
+        stop = np.searchsorted(self.values, hi, side='left')
+        return self.labels[start:max(start, stop)]
+
+    def outside(self, lo, hi):
+        # Labels of the rows with value < lo or value > hi, in feature order
+        start = np.searchsorted(self.values, lo, side='left')
+        stop = np.searchsorted(self.values, hi, side='right')
+        return np.concatenate([self.labels[:start], self.labels[max(start, stop):]])
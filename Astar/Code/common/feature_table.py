@@ -0,0 +1,87 @@
+'''
+    AuNRs candidate table: one row per measured well with its formula and peak features
+    The rows of a parameter sheet are the wells of the same-named UV-Vis plate, in order
+    (H1..H12 for the -1 plates, A1..A12 for the -2 plates).
+'''
+import numpy as np
+import pandas as pd
+
+from common.file_cache import CACHE_DIR
+from common.ingest import ingest_dirs
+from common.peak_features import PEAK_PROMINENCE
+from common.spectral_store import SpectralStore
+
+# Name of the candidate table among the machine outputs
+FEATURE_TABLE = 'AuNRs_features'
+
+PARAM_COLS = ['超纯水/mL', 'CTAB(s)/g', 'NaOL(s)/g', '1mM HAuCl4/mL', '4mM AgNO3/mL', '3.6542M 盐酸/mL', 'AA/mL',
+              '晶种/mL']
+
+# Wavelengths (nm) the longitudinal (2nd) peak may take. Scans reach 999 nm, where the water
+# overtone band near 970 nm would otherwise pass for the longest-wavelength peak.
+LSPR_BAND = (550, 940)
+
+# Columns the AuNRs scripts read besides the formula
+PEAK_COLS = ['peak_num', '2nd_peak_wave', '2nd_peak_width', '2nd_peak_ratio', '2nd_peak_diff']
+
+
+def get_plate_params(param_name_list):
+    '''
+        Formula rows by plate name
+        Only PARAM_COLS are kept, the sheets also carry notes and temperatures in other columns.
+    '''
+    ret = {}
+    for data in param_name_list:
+        data = data.dropna(how='all', subset=[col for col in PARAM_COLS if col in data.columns])
+        ret[data['day'].iloc[0]] = data.reindex(columns=PARAM_COLS).reset_index(drop=True)
+    return ret
+
+
+def join_plate_params(spectral_store, plate_params, prominence=PEAK_PROMINENCE, lspr_band=LSPR_BAND):
+    '''
+        Join the peak features of every plate with its formula rows
+        The 2nd peak is looked for in lspr_band only. Returns the table and (plate, reason) for
+        each plate that could not be joined.
+    '''
+    peaks = spectral_store.peak_features(prominence, lspr_band)
+    tables = []
+    failures = []
+    for key in spectral_store.keys():
+        plate = key.partition('_')[2]
+        if plate not in plate_params:
+            failures.append((plate, 'no parameter sheet'))
+            continue
+        params = plate_params[plate]
+        p = spectral_store.plates.loc[key]
+        if p['row_stop'] - p['row_start'] != len(params):
+            failures.append((plate, f"{p['row_stop'] - p['row_start']} wells but {len(params)} parameter rows"))
+            continue
+        table = params.copy()
+        table['wave_name'] = spectral_store.index['well'].iloc[p['row_start']:p['row_stop']].astype(str).values
+        table['label'] = plate
+        rows = peaks.iloc[p['row_start']:p['row_stop']].reset_index(drop=True)
+        for col in PEAK_COLS:
+            table[col] = rows[col].values
+        tables.append(table)
+
+    if not tables:
+        return pd.DataFrame(columns=['wave_name', 'label'] + PEAK_COLS), failures
+    return pd.concat(tables, axis=0).reset_index(drop=True), failures
+
+
+def get_candidates(table):
+    # Wells without a longitudinal (2nd) peak have nothing to score
+    return table[~np.isnan(table['2nd_peak_wave'].astype(float))].reset_index(drop=True)
+
+
+def build_feature_table(dir_list, workers=None, cache_dir=CACHE_DIR, prominence=PEAK_PROMINENCE,
+                        lspr_band=LSPR_BAND):
+    '''
+        Table of every joined well of the UV-Vis and parameter folders in dir_list, and the store of their plates
+        Wells without a longitudinal (2nd) peak are kept with NaN 2nd_peak_* features.
+    '''
+    ingest = ingest_dirs(dir_list, workers, cache_dir)
+    spectral_store = SpectralStore.build(f'{cache_dir}/AuNRs_spectra', ingest.wave_name_dict)
+    table, failures = join_plate_params(spectral_store, get_plate_params(ingest.param_name_list), prominence,
+                                        lspr_band)
+    return table, spectral_store, ingest.failures + failures
@@ -0,0 +1,115 @@
+'''
+    Cache of parsed formula and spectrum files
+    A file is looked up by path, size and mtime first; when those changed its content
+    hash decides whether an already parsed copy can be reused.
+'''
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.uv_vis import PlateSpectrum
+
+CACHE_DIR = '.astar_cache'
+# Bump when a parser changes what it returns, so stale entries are not reused
+CACHE_VERSION = 1
+
+
+def get_content_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_parser_name(parser):
+    return f'{parser.__module__}.{parser.__qualname__}.v{CACHE_VERSION}'
+
+
+def write_atomic(path, write):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_spectrum(path, spectrum):
+    with open(path, 'wb') as f:
+        np.savez(f, wavelength=spectrum.wavelength, absorbance=spectrum.absorbance,
+                 wells=np.array(spectrum.wells, dtype=str))
+
+
+def load_spectrum(path):
+    with np.load(path) as data:
+        return PlateSpectrum(data['wavelength'], data['absorbance'], data['wells'].tolist())
+
+
+# Spectra are stored as raw numpy arrays, tables as pickled DataFrames
+blob_formats = {
+    'npz': (save_spectrum, load_spectrum),
+    'pkl': (lambda path, data: data.to_pickle(path), pd.read_pickle),
+}
+
+
+def get_blob_format(data):
+    if isinstance(data, PlateSpectrum):
+        return 'npz'
+    elif isinstance(data, pd.DataFrame):
+        return 'pkl'
+    raise TypeError(f'cannot cache {type(data).__name__}')
+
+
+def find_blob(cache_dir, blob_name):
+    for fmt in blob_formats:
+        blob_path = f'{cache_dir}/{blob_name}.{fmt}'
+        if os.path.exists(blob_path):
+            return blob_path, fmt
+    return None, None
+
+
+def load_cached(path, parser, cache_dir=CACHE_DIR):
+    '''
+        Return parser(path), reusing the parsed copy stored under cache_dir when the file is unchanged
+    '''
+    os.makedirs(f'{cache_dir}/index', exist_ok=True)
+    stat = os.stat(path)
+    parser_name = get_parser_name(parser)
+    entry_key = hashlib.sha1(f'{os.path.abspath(path)}|{parser_name}'.encode('utf-8')).hexdigest()
+    entry_path = f'{cache_dir}/index/{entry_key}.json'
+
+    if os.path.exists(entry_path):
+        with open(entry_path, encoding='utf-8') as f:
+            entry = json.load(f)
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            blob_path = f"{cache_dir}/{entry['blob']}"
+            if os.path.exists(blob_path):
+                return blob_formats[entry['format']][1](blob_path)
+
+    content_hash = get_content_hash(path)
+    blob_name = hashlib.sha1(f'{content_hash}|{parser_name}'.encode('utf-8')).hexdigest()
+    blob_path, fmt = find_blob(cache_dir, blob_name)
+    if blob_path is not None:
+        data = blob_formats[fmt][1](blob_path)
+    else:
+        data = parser(path)
+        fmt = get_blob_format(data)
+        blob_path = f'{cache_dir}/{blob_name}.{fmt}'
+        write_atomic(blob_path, lambda tmp_path: blob_formats[fmt][0](tmp_path, data))
+
+    entry = {
+        'path': os.path.abspath(path),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'hash': content_hash,
+        'blob': os.path.basename(blob_path),
+        'format': fmt,
+    }
+
+    def write_entry(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+
+    write_atomic(entry_path, write_entry)
+    return data
@@ -0,0 +1,116 @@
+'''
+    Parallel ingestion of campaign data folders
+    Every file of every folder is parsed in a process pool, then the results are merged
+    in (folder, file name) order so the outcome does not depend on scheduling.
+'''
+import multiprocessing
+import os
+import re
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+
+import pandas as pd
+
+from common.file_cache import CACHE_DIR, load_cached
+from common.uv_vis import frame_to_spectrum, read_plate_spectrum
+
+
+class FileFormat(Enum):
+    txt = "txt"
+    xlsx = "xlsx"
+
+
+# e.g. 小尺寸AuNSs-20230724-1.xlsx, AuNSs-20230627.xlsx, 20230320-1.txt
+file_name_pattern = re.compile(r'(?:([\u4e00-\u9fa5a-zA-Z]*)-)?([\w-]+)\.(txt|xlsx)')
+
+# Workbooks under these folders hold normalized spectra instead of formula rows
+SPECTRUM_DIR_MARKERS = ('normalization', '归一化')
+
+IngestResult = namedtuple('IngestResult', ['wave_name_dict', 'param_name_list', 'failures'])
+
+
+def parse_file_name(fname):
+    m = file_name_pattern.fullmatch(fname)
+    if m is None:
+        raise ValueError(f'unexpected file name {fname}')
+    name, day, fmt = m.groups()
+    return name or '', day, FileFormat(fmt)
+
+
+def list_data_files(dir_list):
+    files = []
+    for file_dir in dir_list:
+        for fname in sorted(os.listdir(file_dir)):
+            if not fname.startswith('.'):
+                files.append((file_dir, fname))
+    return files
+
+
+def parse_data_file(file_dir, fname, cache_dir=CACHE_DIR):
+    '''
+        Parse one data file into (is_spectrum, key, data)
+        Spectra are PlateSpectrum keyed by f'{name}_{day}', formula rows get a 'day' column instead.
+    '''
+    name, day, fmt = parse_file_name(fname)
+    file_path = f'{file_dir}/{fname}'
+
+    if fmt == FileFormat.txt:
+        return True, f'{name}_{day}', load_cached(file_path, read_plate_spectrum, cache_dir)
+
+    data = load_cached(file_path, pd.read_excel, cache_dir)
+    if any(marker in file_dir for marker in SPECTRUM_DIR_MARKERS):
+        return True, f'{name}_{day}', frame_to_spectrum(data)
+    data['day'] = day
+    return False, day, data
+
+
+def parse_task(task):
+    file_dir, fname, cache_dir = task
+    try:
+        return parse_data_file(file_dir, fname, cache_dir), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def get_pool_context():
+    # fork does not re-run the calling script in the workers. Without it, only interactive
+    # sessions (notebooks) are safe to spawn from, plain scripts fall back to serial parsing.
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    if not hasattr(sys.modules['__main__'], '__file__'):
+        return multiprocessing.get_context()
+    return None
+
+
+def ingest_dirs(dir_list, workers=None, cache_dir=CACHE_DIR):
+    '''
+        Parse every file under dir_list
+        Returns the spectra by key, the formula tables, and (path, error) for each file that failed.
+    '''
+    files = list_data_files(dir_list)
+    tasks = [(file_dir, fname, cache_dir) for file_dir, fname in files]
+    workers = workers or os.cpu_count() or 1
+    context = get_pool_context()
+
+    if workers == 1 or context is None or len(tasks) < 2:
+        results = [parse_task(task) for task in tasks]
+    else:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            results = list(executor.map(parse_task, tasks, chunksize=chunksize))
+
+    wave_name_dict = {}
+    param_name_list = []
+    failures = []
+    for (file_dir, fname), (parsed, error) in zip(files, results):
+        if error is not None:
+            failures.append((f'{file_dir}/{fname}', error))
+            continue
+        is_spectrum, key, data = parsed
+        if is_spectrum:
+            wave_name_dict[key] = data
+        else:
+            param_name_list.append(data)
+    return IngestResult(wave_name_dict, param_name_list, failures)
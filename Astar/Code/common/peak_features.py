@@ -0,0 +1,76 @@
+'''
+    Peak features of absorbance curves
+    A curve without any peak gets peak_num 0 and NaN in every other feature, so callers
+    can tell "no peak" apart from a real peak at an error of 0.
+'''
+import numpy as np
+import pandas as pd
+from scipy.signal import find_peaks, peak_widths
+
+PEAK_PROMINENCE = 0.03
+
+FEATURE_COLS = ['peak_num',
+                '1st_peak_wave', '1st_peak_width', '1st_peak_prominence',
+                '2nd_peak_wave', '2nd_peak_width', '2nd_peak_prominence',
+                '2nd_peak_ratio', '2nd_peak_diff']
+
+
+def get_curve_peaks(wavelength, curve, prominence=PEAK_PROMINENCE, band=None):
+    '''
+        Features of one curve: the first peak, and the longest-wavelength later peak as the 2nd peak
+        band (low, high) in nm only lets later peaks inside it be the 2nd peak, e.g. to skip the
+        water band near 970 nm. Widths are the FWHM in nm, 2nd_peak_ratio is the 2nd/1st peak
+        absorbance, 2nd_peak_diff the 2nd - 1st peak wavelength.
+    '''
+    ret = dict.fromkeys(FEATURE_COLS, np.nan)
+    valid = ~np.isnan(curve)
+    x = wavelength[valid]
+    y = curve[valid]
+    peaks, properties = find_peaks(y, prominence=prominence)
+    ret['peak_num'] = len(peaks)
+    if len(peaks) == 0:
+        return ret
+
+    widths, _, left_ips, right_ips = peak_widths(y, peaks, rel_height=0.5)
+    samples = np.arange(len(x))
+    fwhm = np.interp(right_ips, samples, x) - np.interp(left_ips, samples, x)
+
+    ret['1st_peak_wave'] = x[peaks[0]]
+    ret['1st_peak_width'] = fwhm[0]
+    ret['1st_peak_prominence'] = properties['prominences'][0]
+    later = np.arange(1, len(peaks))
+    if band is not None:
+        later = later[(x[peaks[later]] >= band[0]) & (x[peaks[later]] <= band[1])]
+    if len(later) > 0:
+        i = later[-1]
+        ret['2nd_peak_wave'] = x[peaks[i]]
+        ret['2nd_peak_width'] = fwhm[i]
+        ret['2nd_peak_prominence'] = properties['prominences'][i]
+        ret['2nd_peak_ratio'] = y[peaks[i]] / y[peaks[0]]
+        ret['2nd_peak_diff'] = x[peaks[i]] - x[peaks[0]]
+    return ret
+
+
+def get_peak_features(wavelength, curves, prominence=PEAK_PROMINENCE, band=None):
+    '''
+        Features of every row of curves ((n_curves, len(wavelength)), NaN where not measured)
+    '''
+    wavelength = np.asarray(wavelength, dtype=float)
+    rows = [get_curve_peaks(wavelength, np.asarray(curve, dtype=float), prominence, band) for curve in curves]
+    features = pd.DataFrame(rows, columns=FEATURE_COLS)
+    features['peak_num'] = features['peak_num'].astype(int)
+    return features
+
+
+def get_target_peaks(data_target, wave_cols, absor_cols, prominence=PEAK_PROMINENCE):
+    # Peak features of the raw target curves, one row per (wave_col, absor_col) pair
+    rows = []
+    for wcol, acol in zip(wave_cols, absor_cols):
+        wavelength = data_target[wcol].astype(float).values
+        valid = wavelength > 0
+        order = np.argsort(wavelength[valid], kind='stable')
+        rows.append(get_curve_peaks(wavelength[valid][order],
+                                    data_target[acol].astype(float).values[valid][order], prominence))
+    features = pd.DataFrame(rows, columns=FEATURE_COLS)
+    features['peak_num'] = features['peak_num'].astype(int)
+    return features
@@ -0,0 +1,121 @@
+'''
+    Reporting stage: machine outputs, plots and the Excel export
+    Tables go to output/ as parquet (pickle when pyarrow is not installed or a column does not
+    convert, e.g. mixed text and numbers). Plots are rendered to files by a worker process while
+    the pipeline keeps running. Excel workbooks are only written by export_excel.py.
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from common.ingest import get_pool_context
+
+OUTPUT_DIR = 'output'
+OUTPUT_FORMATS = ['parquet', 'pkl']
+
+
+def get_output_path(name, fmt, output_dir=OUTPUT_DIR):
+    return f'{output_dir}/{name}.{fmt}'
+
+
+def write_output(data, name, output_dir=OUTPUT_DIR):
+    '''
+        Write a table under output_dir and return its path
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    for fmt in OUTPUT_FORMATS:
+        path = get_output_path(name, fmt, output_dir)
+        try:
+            if fmt == 'parquet':
+                data.to_parquet(path, index=False)
+            else:
+                data.to_pickle(path)
+        except (ImportError, TypeError, ValueError):
+            continue
+        # Only the newest copy of a table may exist, so readers never pick up a stale one
+        for other in OUTPUT_FORMATS:
+            if other != fmt and os.path.exists(get_output_path(name, other, output_dir)):
+                os.remove(get_output_path(name, other, output_dir))
+        return path
+    raise ValueError(f'{name} could not be written in any of {OUTPUT_FORMATS}')
+
+
+def find_output(name, output_dir=OUTPUT_DIR):
+    for fmt in OUTPUT_FORMATS:
+        path = get_output_path(name, fmt, output_dir)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def has_output(name, output_dir=OUTPUT_DIR):
+    return find_output(name, output_dir) is not None
+
+
+def read_output(name, output_dir=OUTPUT_DIR):
+    path = find_output(name, output_dir)
+    if path is None:
+        raise FileNotFoundError(f'no output named {name} in {output_dir}')
+    return pd.read_parquet(path) if path.endswith('.parquet') else pd.read_pickle(path)
+
+
+def list_outputs(output_dir=OUTPUT_DIR):
+    names = set()
+    for fname in os.listdir(output_dir):
+        name, _, fmt = fname.rpartition('.')
+        if fmt in OUTPUT_FORMATS:
+            names.add(name)
+    return sorted(names)
+
+
+def export_excel(name, output_dir=OUTPUT_DIR):
+    # Excel copy of one machine output, next to it
+    path = f'{output_dir}/{name}.xlsx'
+    read_output(name, output_dir).to_excel(path, header=True, index=False)
+    return path
+
+
+def plot_frame(data, path, kwargs):
+    # Runs in the worker; the Agg backend never opens a window
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    ax = data.plot(**kwargs)
+    ax.figure.savefig(path, bbox_inches='tight')
+    plt.close(ax.figure)
+
+
+class PlotReporter:
+    '''
+        Renders DataFrame.plot figures to png files under output_dir
+        Without a usable process pool the figures are rendered in close() instead, after the
+        pipeline has finished.
+    '''
+
+    def __init__(self, output_dir=OUTPUT_DIR):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        context = get_pool_context()
+        self.executor = ProcessPoolExecutor(max_workers=1, mp_context=context) if context is not None else None
+        self.futures = []
+        self.deferred = []
+
+    def plot(self, data, name, **kwargs):
+        path = f'{self.output_dir}/{name}.png'
+        if self.executor is not None:
+            self.futures.append(self.executor.submit(plot_frame, data, path, kwargs))
+        else:
+            self.deferred.append((data, path, kwargs))
+        return path
+
+    def close(self):
+        for data, path, kwargs in self.deferred:
+            plot_frame(data, path, kwargs)
+        self.deferred = []
+        if self.executor is not None:
+            for future in self.futures:
+                future.result()
+            self.executor.shutdown()
+            self.executor = None
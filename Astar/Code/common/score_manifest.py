@@ -0,0 +1,87 @@
+'''
+    Incremental scoring of well spectra against a target workbook
+    A manifest records the (day, well, plate hash, target hash) of every scored well; a run
+    only scores the wells whose plate is new or changed, or all of them once the target file or
+    the scoring settings changed (see get_score_hash).
+'''
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from common.file_cache import get_content_hash, write_atomic
+
+# Manifest and results are pickled together, so one can never be newer than the other
+SCORES_FILE = 'scores.pkl'
+
+# Scores of every well in store order, and the store rows that had to be scored in this run
+ScoreResult = namedtuple('ScoreResult', ['results', 'scored'])
+
+
+def get_plate_hash(spectral_store, key):
+    spectrum = spectral_store.plate(key)
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(spectrum.wavelength, dtype=float).tobytes())
+    h.update(np.ascontiguousarray(spectrum.absorbance).tobytes())
+    h.update('|'.join(spectrum.wells).encode('utf-8'))
+    return h.hexdigest()
+
+
+def get_score_hash(target_file, wavelength, **settings):
+    '''
+        target_hash of score_plates: the target file, the store wavelength grid the target curves
+        are resampled on, and every scoring setting (e.g. target_size, size_idx, prominence)
+    '''
+    h = hashlib.sha1(get_content_hash(target_file).encode('utf-8'))
+    h.update(np.ascontiguousarray(wavelength, dtype=float).tobytes())
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def get_well_manifest(spectral_store, target_hash):
+    # One row per store row, in store order
+    plate_hash = {key: get_plate_hash(spectral_store, key) for key in spectral_store.keys()}
+    days = spectral_store.row_keys()
+    return pd.DataFrame({'day': days,
+                         'wave': spectral_store.index['well'].astype(str).values,
+                         'plate_hash': [plate_hash[day] for day in days],
+                         'target_hash': target_hash})
+
+
+def score_plates(path, spectral_store, target_hash, score_rows):
+    '''
+        ScoreResult of every well of spectral_store, one row per store row in store order
+        score_rows(rows) scores the given store rows and returns a frame with 'day' and 'wave'
+        columns. Results of wells already scored with the same plate and target are reused.
+    '''
+    os.makedirs(path, exist_ok=True)
+    manifest = get_well_manifest(spectral_store, target_hash)
+    keys = ['day', 'wave', 'plate_hash', 'target_hash']
+    if os.path.exists(f'{path}/{SCORES_FILE}'):
+        saved = pd.read_pickle(f'{path}/{SCORES_FILE}')
+        scored, results = saved['manifest'], saved['results']
+    else:
+        scored = pd.DataFrame(columns=keys)
+        results = None
+
+    # Position of each well in the previous results, -1 when it has to be scored again
+    scored = scored.assign(old_row=np.arange(len(scored)))
+    old_row = manifest.merge(scored, on=keys, how='left')['old_row'].fillna(-1).astype(int).values
+    stale = np.flatnonzero(old_row < 0)
+
+    parts = []
+    if results is not None and len(stale) < len(manifest):
+        kept = np.flatnonzero(old_row >= 0)
+        parts.append(results.iloc[old_row[kept]].set_index(kept))
+    if len(stale) > 0:
+        parts.append(score_rows(stale).set_index(stale))
+    if parts:
+        results = pd.concat(parts, axis=0).sort_index().reset_index(drop=True)
+    else:
+        results = score_rows(stale)
+
+    write_atomic(f'{path}/{SCORES_FILE}', lambda p: pd.to_pickle({'manifest': manifest, 'results': results}, p))
+    return ScoreResult(results, stale)
@@ -0,0 +1,175 @@
+'''
+    Seeded Monte Carlo restarts of the simulated AuNRs campaigns over a process pool
+    The candidate table and its neighbour graph are saved once as .npy files that every worker
+    memory-maps, in a directory named after their hash that is never rewritten in place. Restart i of a target always draws from np.random.default_rng([target, i]), so
+    any run can be replayed alone.
+'''
+import hashlib
+import json
+import os
+import shutil
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from common.astar_optimizer import OBJECTIVES, NeighbourGraph, TableSearch
+from common.feature_index import FeatureIndex
+from common.ingest import get_pool_context
+
+INFO_FILE = 'info.json'
+PEAK_WAVE_COL = '2nd_peak_wave'
+
+# n starting rows, in_n of them within thres of target on the LSPR; stop_thres=None runs every
+# campaign to max_step. Each step is a plate of batch_size experiments. objective may be a tuple
+# of objectives scored together, combined by mode ('weighted' or 'pareto') with weights. A
+# Surrogate blends its prediction into si_ucb, which needs formula_cols in save_table.
+Campaign = namedtuple('Campaign', ['objective', 'target', 'n', 'in_n', 'thres', 'max_step', 'delta_cnt',
+                                   'stop_thres', 'acquisition', 'batch_size', 'penalty', 'mode', 'weights',
+                                   'surrogate'],
+                      defaults=[10, None, 'ucb1', 1, 0.05, 'weighted', None, None])
+
+# Table of the worker process, opened once by init_worker
+worker_table = {}
+
+
+def save_table(cache_dir, data, graph, formula_cols=()):
+    '''
+        Save the objective, LSPR and formula columns of the candidate table and the neighbour graph;
+        returns the table directory under cache_dir
+        The directory is named after the hash of what it holds and is written under a temporary
+        name, so workers of another script never see a table change under their memory maps.
+    '''
+    cols = [PEAK_WAVE_COL] + [o.column for o in OBJECTIVES.values()] + list(formula_cols)
+    cols = [col for col in dict.fromkeys(cols) if col in data]
+    arrays = [data[col].values.astype(float) for col in cols]
+    h = hashlib.sha1(json.dumps(cols, ensure_ascii=False).encode('utf-8'))
+    for arr in arrays + [graph.indptr, graph.indices]:
+        h.update(np.ascontiguousarray(arr).tobytes())
+    path = f'{cache_dir}/{h.hexdigest()}'
+    if os.path.exists(f'{path}/{INFO_FILE}'):
+        return path
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for i, arr in enumerate(arrays):
+        np.save(f'{tmp_path}/col_{i}.npy', arr)
+    np.save(f'{tmp_path}/indptr.npy', graph.indptr)
+    np.save(f'{tmp_path}/indices.npy', graph.indices)
+    with open(f'{tmp_path}/{INFO_FILE}', 'w', encoding='utf-8') as f:
+        json.dump({'columns': cols}, f, ensure_ascii=False)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another script published the same table first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
+
+
+def open_table(path):
+    with open(f'{path}/{INFO_FILE}', encoding='utf-8') as f:
+        cols = json.load(f)['columns']
+    data = pd.DataFrame({col: np.load(f'{path}/col_{i}.npy', mmap_mode='r') for i, col in enumerate(cols)},
+                        copy=False)
+    graph = NeighbourGraph(np.load(f'{path}/indptr.npy', mmap_mode='r'), np.load(f'{path}/indices.npy', mmap_mode='r'))
+    return data, graph, FeatureIndex(data[PEAK_WAVE_COL].values)
+
+
+def pick_start_rows(peak_wave_index, rng, n, in_n, target, thres):
+    # in_n rows with the LSPR inside the target window, the rest outside of it; a side with too
+    # few rows gives all it has, which run_chunk records as missing_starts
+    inside = peak_wave_index.between(target - thres, target + thres)
+    outside = peak_wave_index.outside(target - thres, target + thres)
+    return np.concatenate([rng.choice(inside, min(in_n, len(inside)), replace=False),
+                           rng.choice(outside, min(n - in_n, len(outside)), replace=False)]).astype(int)
+
+
+def replay(data, graph, peak_wave_index, campaign, restart, checkpoint=None):
+    '''
+        Run one restart of campaign; returns (search, steps, reached)
+        checkpoint saves the search after every plate and resumes from it (see TableSearch.run).
+    '''
+    rng = np.random.default_rng([campaign.target, restart])
+    rows = pick_start_rows(peak_wave_index, rng, campaign.n, campaign.in_n, campaign.target, campaign.thres)
+    search = TableSearch(data, campaign.objective, graph, campaign.target, acquisition=campaign.acquisition,
+                         mode=campaign.mode, weights=campaign.weights, surrogate=campaign.surrogate)
+    stop = None
+    if campaign.stop_thres is not None:
+        stop = lambda results: (np.abs(results - campaign.target) < campaign.stop_thres).any()
+    step, reached = search.run(rows, campaign.max_step, campaign.delta_cnt, stop, rng,
+                               batch_size=campaign.batch_size, penalty=campaign.penalty, checkpoint=checkpoint)
+    return search, step, reached
+
+
+def init_worker(path):
+    data, graph, peak_wave_index = open_table(path)
+    worker_table.update(data=data, graph=graph, peak_wave_index=peak_wave_index)
+
+
+def run_chunk(campaign, restarts):
+    ret = []
+    for restart in restarts:
+        search, step, reached = replay(worker_table['data'], worker_table['graph'], worker_table['peak_wave_index'],
+                                       campaign, restart)
+        # best_zi is on the weighted sum of the objectives
+        ret.append({'restart': restart, 'steps': step, 'experiments': int(search.is_close.sum()),
+                    'reached': reached if campaign.stop_thres is not None else np.nan,
+                    'best_zi': search.zi[search.is_close].max() if search.is_close.any() else np.nan,
+                    'missing_starts': campaign.n - len(search.start_rows)})
+    return ret
+
+
+def run_restarts(path, campaign, restarts, workers=None):
+    '''
+        One row per restart of campaign on the table saved under path: steps (plates), experiments,
+        reached, best_zi, missing_starts
+        reached is NaN for campaigns without stop_thres. missing_starts counts the starting rows the
+        target window (or the rest of the table) was too small to give.
+    '''
+    restarts = list(restarts)
+    workers = workers or os.cpu_count() or 1
+    context = get_pool_context()
+    # No restarts give no chunks and an empty frame
+    chunks = [chunk.tolist() for chunk in np.array_split(restarts, max(1, min(len(restarts), workers * 4)))
+              if len(chunk)]
+
+    if workers == 1 or context is None or len(chunks) < 2:
+        init_worker(path)
+        results = [run_chunk(campaign, chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                 initargs=(path,)) as executor:
+            results = list(executor.map(run_chunk, repeat(campaign), chunks))
+
+    runs = pd.DataFrame([row for chunk in results for row in chunk],
+                        columns=['restart', 'steps', 'experiments', 'reached', 'best_zi', 'missing_starts'])
+    # Objectives scored together are labelled lspr+peak_ratio+...
+    objective = campaign.objective
+    runs.insert(0, 'objective', objective if isinstance(objective, str) else '+'.join(objective))
+    for field in ['target', 'acquisition', 'batch_size']:
+        runs.insert(0, field, getattr(campaign, field))
+    return runs
+
+
+def summarize(runs, by=('objective', 'acquisition', 'batch_size', 'target')):
+    '''
+        Steps-to-target distribution of every campaign in runs
+        Steps are taken over the runs that reached the target, or over every run when the
+        campaign has no stop rule (failure_rate NaN). short_start_runs counts the runs that started
+        from fewer rows than asked.
+    '''
+    def stats(group):
+        reached = group['reached'].astype(float)
+        steps = group.loc[reached != 0, 'steps']
+        return pd.Series({'runs': len(group), 'failure_rate': 1.0 - reached.mean(),
+                          'steps_mean': steps.mean(), 'steps_p10': steps.quantile(0.1),
+                          'steps_p50': steps.quantile(0.5), 'steps_p90': steps.quantile(0.9),
+                          'experiments_mean': group.loc[reached != 0, 'experiments'].mean(),
+                          'best_zi_mean': group['best_zi'].mean(),
+                          'short_start_runs': (group['missing_starts'] > 0).sum()})
+    ret = runs.groupby(list(by)).apply(stats).reset_index()
+    ret[['runs', 'short_start_runs']] = ret[['runs', 'short_start_runs']].astype(int)
+    return ret
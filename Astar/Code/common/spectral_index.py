@@ -0,0 +1,196 @@
+'''
+    Approximate nearest-neighbour search over every indexed well spectrum
+    Spectra are resampled onto one fixed grid and grouped into inverted lists around k-means
+    centroids. A query scans the lists of its nprobe closest centroids and ranks those wells
+    exactly, with the same masked mean squared error as curve_distance.
+    Every save writes a new version folder and then switches current.json to it, so an
+    interrupted save leaves the previous version in place.
+'''
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from common.curve_distance import distance_matrix, resample
+from common.file_cache import write_atomic
+from common.score_manifest import get_plate_hash
+
+INDEX_GRID = np.arange(350, 1001, 5, dtype=float)
+
+VECTORS_FILE = 'vectors.npy'
+CENTROIDS_FILE = 'centroids.npy'
+LISTS_FILE = 'lists.npy'
+META_FILE = 'meta.pkl'
+GRID_FILE = 'grid.npy'
+INFO_FILE = 'info.json'
+CURRENT_FILE = 'current.json'
+
+N_PROBE = 4
+KMEANS_ITER = 20
+# Re-cluster once the index has grown this many times past the size it was clustered at
+RETRAIN_FACTOR = 4
+
+
+def get_list_count(n_rows):
+    return int(np.clip(np.sqrt(n_rows), 1, 1024))
+
+
+def nearest_centroid(vectors, centroids):
+    distance = distance_matrix(vectors, centroids)
+    return np.argmin(np.where(np.isnan(distance), np.inf, distance), axis=1)
+
+
+def kmeans(vectors, n_lists, n_iter=KMEANS_ITER, seed=0):
+    '''
+        k-means on curves with NaN gaps; a centroid point is the mean of the members that cover it
+    '''
+    rng = np.random.default_rng(seed)
+    centroids = np.array(vectors[rng.choice(len(vectors), n_lists, replace=False)], dtype=float)
+    mask = ~np.isnan(vectors)
+    values = np.where(mask, vectors, 0.0)
+    for _ in range(n_iter):
+        lists = nearest_centroid(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        counts = np.zeros_like(centroids)
+        np.add.at(sums, lists, values)
+        np.add.at(counts, lists, mask.astype(float))
+        # Empty lists and uncovered points keep their previous centroid
+        covered = counts > 0
+        new_centroids = np.where(covered, sums / np.maximum(counts, 1), centroids)
+        if np.allclose(new_centroids, centroids, equal_nan=True):
+            break
+        centroids = new_centroids
+    return centroids, nearest_centroid(vectors, centroids)
+
+
+def get_version(path):
+    # Folder of the current version of the index at path, None when there is no index yet
+    if not os.path.exists(f'{path}/{CURRENT_FILE}'):
+        return None
+    with open(f'{path}/{CURRENT_FILE}') as f:
+        return f"{path}/{json.load(f)['version']}"
+
+
+def get_formula(spectral_store, data, cols, key_col='day', well_col='wave'):
+    '''
+        Formula columns of data indexed by store row, for SpectralIndex.add
+        Rows that match no stored well are dropped, a well matched twice keeps its first row.
+    '''
+    rows = spectral_store.locate(data[key_col].values, data[well_col].values)
+    formula = data.loc[rows >= 0, cols].set_index(rows[rows >= 0])
+    return formula[~formula.index.duplicated()]
+
+
+class SpectralIndex:
+
+    def __init__(self, path):
+        self.path = path
+        version = get_version(path)
+        self.grid = np.load(f'{version}/{GRID_FILE}')
+        self.vectors = np.load(f'{version}/{VECTORS_FILE}', mmap_mode='r')
+        self.centroids = np.load(f'{version}/{CENTROIDS_FILE}')
+        self.lists = np.load(f'{version}/{LISTS_FILE}')
+        with open(f'{version}/{INFO_FILE}') as f:
+            self.trained_size = json.load(f)['trained_size']
+        # One row per vector: dataset, plate key, well, plate hash, then the formula columns
+        self.meta = pd.read_pickle(f'{version}/{META_FILE}')
+        # Rows grouped by list, so the members of list c are order[offsets[c]:offsets[c + 1]]
+        self.order = np.argsort(self.lists, kind='stable')
+        self.offsets = np.searchsorted(self.lists[self.order], np.arange(len(self.centroids) + 1))
+
+    @staticmethod
+    def open(path, grid=INDEX_GRID):
+        # Open the index at path, creating an empty one on first use
+        if get_version(path) is None:
+            os.makedirs(path, exist_ok=True)
+            SpectralIndex.save(path, np.asarray(grid, dtype=float), np.empty((0, len(grid)), dtype=np.float32),
+                               np.empty((0, len(grid))), np.empty(0, dtype=np.int32),
+                               pd.DataFrame(columns=['dataset', 'key', 'well', 'plate_hash']), 0)
+        return SpectralIndex(path)
+
+    @staticmethod
+    def save(path, grid, vectors, centroids, lists, meta, trained_size):
+        # A new version folder, made current once all of its files are written
+        versions = [int(os.path.basename(v)[1:]) for v in glob.glob(f'{path}/v[0-9]*')]
+        version = f'v{max(versions, default=0) + 1:06d}'
+        version_path = f'{path}/{version}'
+        shutil.rmtree(version_path, ignore_errors=True)
+        os.makedirs(version_path)
+        np.save(f'{version_path}/{GRID_FILE}', grid)
+        np.save(f'{version_path}/{VECTORS_FILE}', np.asarray(vectors, dtype=np.float32))
+        np.save(f'{version_path}/{CENTROIDS_FILE}', centroids)
+        np.save(f'{version_path}/{LISTS_FILE}', np.asarray(lists, dtype=np.int32))
+        with open(f'{version_path}/{INFO_FILE}', 'w') as f:
+            json.dump({'trained_size': int(trained_size)}, f)
+        meta.to_pickle(f'{version_path}/{META_FILE}')
+
+        def write_current(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': version}, f)
+
+        write_atomic(f'{path}/{CURRENT_FILE}', write_current)
+        # Older versions, and folders of saves that never finished, go once nothing points to them
+        for old in glob.glob(f'{path}/v[0-9]*'):
+            if os.path.basename(old) != version:
+                shutil.rmtree(old, ignore_errors=True)
+
+    def __len__(self):
+        return len(self.meta)
+
+    def add(self, dataset, spectral_store, formula=None):
+        '''
+            Index the plates of spectral_store that dataset does not have yet, or has with other spectra
+            Plates are compared by key and plate hash, as in score_manifest; the wells of a changed
+            plate replace the ones indexed before. formula is indexed by store row and holds the
+            formula parameters of each well. Returns the reopened index.
+        '''
+        plate_hash = {key: get_plate_hash(spectral_store, key) for key in spectral_store.keys()}
+        ours = (self.meta['dataset'] == dataset).values
+        known = set(zip(self.meta['key'].values[ours], self.meta['plate_hash'].values[ours]))
+        new_keys = [key for key, h in plate_hash.items() if (key, h) not in known]
+        if not new_keys:
+            return self
+        keep = ~(ours & self.meta['key'].isin(new_keys).values)
+
+        rows = np.concatenate([np.arange(*spectral_store.plates.loc[key, ['row_start', 'row_stop']])
+                               for key in new_keys])
+        new_vectors = resample(spectral_store.wavelength, np.asarray(spectral_store.take(rows)).T, self.grid)
+        new_meta = pd.DataFrame({'dataset': dataset, 'key': spectral_store.row_keys()[rows],
+                                 'well': spectral_store.index['well'].astype(str).values[rows]})
+        new_meta['plate_hash'] = new_meta['key'].map(plate_hash)
+        if formula is not None:
+            new_meta = new_meta.join(formula.reindex(rows).reset_index(drop=True))
+
+        vectors = np.concatenate([self.vectors[keep], new_vectors]).astype(np.float32)
+        meta = pd.concat([self.meta[keep], new_meta], axis=0, ignore_index=True)
+        if len(self.centroids) == 0 or len(vectors) > RETRAIN_FACTOR * self.trained_size:
+            centroids, lists = kmeans(vectors, get_list_count(len(vectors)))
+            trained_size = len(vectors)
+        else:
+            centroids = self.centroids
+            lists = np.concatenate([self.lists[keep], nearest_centroid(new_vectors, centroids)])
+            trained_size = self.trained_size
+        del self.vectors
+        SpectralIndex.save(self.path, self.grid, vectors, centroids, lists, meta, trained_size)
+        return SpectralIndex(self.path)
+
+    def search(self, wavelength, curve, k=10, nprobe=N_PROBE):
+        '''
+            Top-k indexed wells closest to one curve, as meta rows with a 'distance' column
+        '''
+        query = resample(wavelength, curve, self.grid)
+        if len(self.centroids) == 0:
+            return self.meta.drop(columns='plate_hash').assign(distance=np.empty(0))
+        centroid_distance = distance_matrix(self.centroids, query)[:, 0]
+        probe = np.argsort(np.where(np.isnan(centroid_distance), np.inf, centroid_distance))[:nprobe]
+        rows = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+        rows.sort()
+
+        distance = distance_matrix(self.vectors[rows], query)[:, 0]
+        distance = np.where(np.isnan(distance), np.inf, distance)
+        top = np.argsort(distance, kind='stable')[:k]
+        top = top[np.isfinite(distance[top])]
+        return self.meta.iloc[rows[top]].drop(columns='plate_hash').assign(distance=distance[top])
@@ -0,0 +1,120 @@
+'''
+    Low-rank (PCA) representation of well spectra
+    A basis is fitted over the wavelength band every spectrum covers. Each well is then kept
+    as a few coefficients plus the RMS of what the basis cannot represent, which bounds the
+    error of any distance computed from the coefficients.
+'''
+from collections import namedtuple
+
+import numpy as np
+
+from common.curve_distance import CHUNK_ROWS
+
+MAX_RMSE = 0.002
+MAX_COMPONENTS = 64
+
+# wavelength: the band grid, mean/components: (d,) and (k, d), rmse: worst reconstruction RMSE of the fit rows
+SpectralBasis = namedtuple('SpectralBasis', ['wavelength', 'mean', 'components', 'rmse'])
+
+
+def get_common_band(wavelength, matrix):
+    '''
+        Grid columns covered by every row that has any measurement
+    '''
+    valid = ~np.isnan(np.asarray(matrix))
+    measured = valid.any(axis=1)
+    first = valid[measured].argmax(axis=1)
+    last = valid.shape[1] - 1 - valid[measured][:, ::-1].argmax(axis=1)
+    return np.arange(first.max(), last.min() + 1)
+
+
+def fit_basis(wavelength, matrix, band=None, max_rmse=MAX_RMSE, max_components=MAX_COMPONENTS,
+              chunk_rows=CHUNK_ROWS):
+    '''
+        Fewest components that reconstruct every fitted row within max_rmse (at most max_components)
+        band holds the grid columns to use, the common band of all rows by default. Rows with a gap
+        inside the band are left out of the fit.
+    '''
+    band = get_common_band(wavelength, matrix) if band is None else np.asarray(band)
+    n_points = len(band)
+
+    # Mean and covariance are accumulated in chunks so the archive never has to fit in memory
+    total = np.zeros(n_points)
+    cross = np.zeros((n_points, n_points))
+    n_rows = 0
+    for start in range(0, len(matrix), chunk_rows):
+        chunk = np.asarray(matrix[start:start + chunk_rows], dtype=float)[:, band]
+        chunk = chunk[~np.isnan(chunk).any(axis=1)]
+        total += chunk.sum(axis=0)
+        cross += chunk.T @ chunk
+        n_rows += len(chunk)
+    if n_rows == 0:
+        raise ValueError('no spectrum covers the whole band')
+    mean = total / n_rows
+    _, eigvec = np.linalg.eigh(cross / n_rows - np.outer(mean, mean))
+    components = eigvec[:, ::-1][:, :min(max_components, n_points)].T
+
+    # Worst residual of the fit rows for every number of components
+    worst = np.zeros(len(components))
+    for start in range(0, len(matrix), chunk_rows):
+        chunk = np.asarray(matrix[start:start + chunk_rows], dtype=float)[:, band]
+        centered = chunk[~np.isnan(chunk).any(axis=1)] - mean
+        energy = (centered ** 2).sum(axis=1, keepdims=True)
+        residual = energy - np.cumsum((centered @ components.T) ** 2, axis=1)
+        if len(residual) > 0:
+            worst = np.maximum(worst, residual.max(axis=0))
+    rmse = np.sqrt(np.maximum(worst, 0.0) / n_points)
+    n_components = int(np.argmax(rmse <= max_rmse)) + 1 if (rmse <= max_rmse).any() else len(components)
+    return SpectralBasis(np.asarray(wavelength)[band], mean, components[:n_components], rmse[n_components - 1])
+
+
+def compress(basis, wavelength, matrix, chunk_rows=CHUNK_ROWS):
+    '''
+        (coefficients, residual) of every row of matrix, sampled at wavelength
+        residual is the RMS reconstruction error of the row. Rows that do not cover the band
+        get NaN, their distances have to be computed on the raw curves.
+    '''
+    band = np.searchsorted(wavelength, basis.wavelength)
+    if np.any(band >= len(wavelength)) or np.any(np.asarray(wavelength)[np.minimum(band, len(wavelength) - 1)]
+                                                  != basis.wavelength):
+        raise ValueError('the grid does not contain the wavelength band of the basis')
+    coefficients = np.full((len(matrix), len(basis.components)), np.nan, dtype=np.float32)
+    residual = np.full(len(matrix), np.nan)
+    for start in range(0, len(matrix), chunk_rows):
+        centered = np.asarray(matrix[start:start + chunk_rows], dtype=float)[:, band] - basis.mean
+        coef = centered @ basis.components.T
+        coefficients[start:start + len(centered)] = coef
+        residual[start:start + len(centered)] = np.sqrt(
+            np.maximum((centered ** 2).sum(axis=1) - (coef ** 2).sum(axis=1), 0.0) / len(band))
+    return coefficients, residual
+
+
+def reduced_distance(basis, sources, targets):
+    '''
+        (n_sources, n_targets) mean squared error over the band, from the coefficients alone
+    '''
+    sources = np.asarray(sources, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    sq_sum = (sources ** 2).sum(axis=1)[:, None] - 2.0 * sources @ targets.T + (targets ** 2).sum(axis=1)[None, :]
+    return np.maximum(sq_sum, 0.0) / len(basis.wavelength)
+
+
+def distance_bound(source_residual, target_residual):
+    '''
+        Bound on |RMSE of the raw curves - RMSE from the coefficients| for every pair
+        By the triangle inequality, the curves differ from their reconstructions by at most
+        the two residuals.
+    '''
+    return np.asarray(source_residual)[:, None] + np.asarray(target_residual)[None, :]
+
+
+def save_compressed(path, basis, coefficients, residual):
+    np.savez(path, wavelength=basis.wavelength, mean=basis.mean, components=basis.components, rmse=basis.rmse,
+             coefficients=coefficients, residual=residual)
+
+
+def load_compressed(path):
+    # (basis, coefficients, residual) as written by save_compressed
+    with np.load(path) as f:
+        basis = SpectralBasis(f['wavelength'], f['mean'], f['components'], float(f['rmse']))
+        return basis, f['coefficients'], f['residual']
@@ -0,0 +1,168 @@
+'''
+    Memory-mapped store of every well spectrum
+    All spectra are rows of one float32 matrix on a shared wavelength grid, NaN where a
+    plate was not scanned. The rows of a plate are contiguous, so a plate is a view.
+'''
+import os
+
+import numpy as np
+import pandas as pd
+
+from common.file_cache import write_atomic
+from common.peak_features import PEAK_PROMINENCE, get_peak_features
+from common.score_manifest import get_plate_hash
+from common.uv_vis import PlateSpectrum, spectrum_to_frame
+
+SPECTRA_FILE = 'spectra.npy'
+WAVELENGTH_FILE = 'wavelength.npy'
+INDEX_FILE = 'index.pkl'
+PLATES_FILE = 'plates.pkl'
+PEAKS_FILE = 'peaks_{prominence}_{band}.pkl'
+
+
+def split_spectrum_key(key):
+    '''
+        '小尺寸AuNSs_20230724-1' -> ('小尺寸AuNSs', '20230724', 1)
+        Plates without a batch suffix are batch 1, as in get_full_wave_name.
+    '''
+    material, _, day = key.rpartition('_')
+    day, _, plate = day.partition('-')
+    return material, day, int(plate) if plate.isdigit() else 1
+
+
+class SpectralStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.wavelength = np.load(f'{path}/{WAVELENGTH_FILE}')
+        self.matrix = np.load(f'{path}/{SPECTRA_FILE}', mmap_mode='r')
+        # One row per well: material, day, plate, well. The row position is the matrix row.
+        self.index = pd.read_pickle(f'{path}/{INDEX_FILE}')
+        # One row per plate: key, row_start/row_stop into the matrix, wave_start/wave_stop into the grid
+        self.plates = pd.read_pickle(f'{path}/{PLATES_FILE}').set_index('key')
+
+    @staticmethod
+    def build(path, spectra):
+        '''
+            Write spectra ({key: PlateSpectrum}) to path and open the result
+        '''
+        os.makedirs(path, exist_ok=True)
+        spectra = {key: spectrum for key, spectrum in spectra.items() if len(spectrum.wells) > 0}
+        if spectra:
+            wavelength = np.unique(np.concatenate([s.wavelength for s in spectra.values()]))
+        else:
+            wavelength = np.array([], dtype=float)
+        n_rows = sum(len(s.wells) for s in spectra.values())
+
+        matrix = np.lib.format.open_memmap(f'{path}/{SPECTRA_FILE}', mode='w+', dtype=np.float32,
+                                           shape=(n_rows, len(wavelength)))
+        matrix[:] = np.nan
+        index = {'material': [], 'day': [], 'plate': [], 'well': []}
+        plates = {'key': [], 'row_start': [], 'row_stop': [], 'wave_start': [], 'wave_stop': []}
+        row = 0
+        for key, spectrum in spectra.items():
+            material, day, plate = split_spectrum_key(key)
+            cols = np.searchsorted(wavelength, spectrum.wavelength)
+            n_wells = len(spectrum.wells)
+            matrix[row:row + n_wells, cols] = spectrum.absorbance.T
+
+            index['material'].extend([material] * n_wells)
+            index['day'].extend([day] * n_wells)
+            index['plate'].extend([plate] * n_wells)
+            index['well'].extend(spectrum.wells)
+            plates['key'].append(key)
+            plates['row_start'].append(row)
+            plates['row_stop'].append(row + n_wells)
+            plates['wave_start'].append(cols.min())
+            plates['wave_stop'].append(cols.max() + 1)
+            row += n_wells
+        matrix.flush()
+        del matrix
+
+        index = pd.DataFrame(index)
+        for col in ['material', 'day', 'well']:
+            index[col] = index[col].astype('category')
+        index['plate'] = index['plate'].astype(np.int16)
+        index.to_pickle(f'{path}/{INDEX_FILE}')
+        pd.DataFrame(plates).to_pickle(f'{path}/{PLATES_FILE}')
+        np.save(f'{path}/{WAVELENGTH_FILE}', wavelength)
+        return SpectralStore(path)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def keys(self):
+        return self.plates.index.tolist()
+
+    def row_keys(self):
+        # Plate key of every matrix row
+        return np.repeat(self.plates.index.values, self.plates['row_stop'] - self.plates['row_start'])
+
+    def plate(self, key):
+        '''
+            Spectrum of one plate; absorbance is a (wavelength, well) view of the memory map
+        '''
+        p = self.plates.loc[key]
+        block = self.matrix[p['row_start']:p['row_stop'], p['wave_start']:p['wave_stop']]
+        wells = self.index['well'].iloc[p['row_start']:p['row_stop']].astype(str).tolist()
+        return PlateSpectrum(self.wavelength[p['wave_start']:p['wave_stop']], block.T, wells)
+
+    def plate_frame(self, key):
+        return spectrum_to_frame(self.plate(key))
+
+    def peak_features(self, prominence=PEAK_PROMINENCE, band=None):
+        '''
+            Peak features of every row (see get_curve_peaks), kept next to the spectra by plate hash
+            The cache outlives rebuilds of the store, so only new or changed plates are computed.
+        '''
+        band_name = '-'.join(map(str, band)) if band is not None else 'all'
+        peaks_path = f'{self.path}/{PEAKS_FILE.format(prominence=prominence, band=band_name)}'
+        cached = pd.read_pickle(peaks_path) if os.path.exists(peaks_path) else {}
+        hashes = [get_plate_hash(self, key) for key in self.keys()]
+        plates = {}
+        for key, plate_hash in zip(self.keys(), hashes):
+            if plate_hash not in cached:
+                p = self.plates.loc[key]
+                cached[plate_hash] = get_peak_features(self.wavelength, self.matrix[p['row_start']:p['row_stop']],
+                                                       prominence, band)
+            plates[plate_hash] = cached[plate_hash]
+        # Plates no longer in the store are dropped from the cache
+        if plates.keys() != cached.keys() or not os.path.exists(peaks_path):
+            write_atomic(peaks_path, lambda path: pd.to_pickle(plates, path))
+        if not plates:
+            return get_peak_features(self.wavelength, self.matrix[:0], prominence, band)
+        return pd.concat([plates[plate_hash] for plate_hash in hashes], axis=0, ignore_index=True)
+
+    def select(self, material=None, day=None, plate=None, well=None):
+        '''
+            Row offsets of the wells matching every given condition (a value or a list of values)
+        '''
+        mask = np.ones(len(self.index), dtype=bool)
+        for col, val in [('material', material), ('day', day), ('plate', plate), ('well', well)]:
+            if val is None:
+                continue
+            vals = val if isinstance(val, (list, tuple, set, np.ndarray)) else [val]
+            mask &= self.index[col].isin(vals).values
+        return np.flatnonzero(mask)
+
+    def locate(self, keys, wells):
+        '''
+            Row offset of every (plate key, well) pair, -1 where the store has no such well
+            Keys are compared by material, day and plate, so '..._20230627' finds '..._20230627-1'.
+        '''
+        parts = [split_spectrum_key(key) for key in keys]
+        query = pd.DataFrame({'material': [p[0] for p in parts], 'day': [p[1] for p in parts],
+                              'plate': np.array([p[2] for p in parts], dtype=np.int16),
+                              'well': np.asarray(wells, dtype=str)})
+        index = self.index.astype({'material': str, 'day': str, 'well': str})
+        index['row'] = np.arange(len(index))
+        index = index.drop_duplicates(subset=['material', 'day', 'plate', 'well'])
+        rows = query.merge(index, on=['material', 'day', 'plate', 'well'], how='left')['row']
+        return rows.fillna(-1).astype(int).values
+
+    def take(self, rows):
+        # A contiguous run of rows is returned as a view, anything else has to be gathered
+        rows = np.asarray(rows)
+        if len(rows) > 0 and np.all(np.diff(rows) == 1):
+            return self.matrix[rows[0]:rows[-1] + 1]
+        return self.matrix[rows]
@@ -0,0 +1,79 @@
+'''
+    Surrogate models of zi over the closed set, to rank open candidates before they are run
+    Formula columns are divided by length_scale (e.g. the neighbour thresholds), so one unit is
+    one neighbourhood along every parameter. A model predicts the mean zi and its uncertainty for
+    all queried formulas in one call; candidates are ranked on mean + kappa * std.
+'''
+from collections import namedtuple
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.spatial import cKDTree
+
+# method is a key of SURROGATES, cols the formula columns it sees; a TableSearch scores the open
+# rows as (1 - weight) * si_ucb + weight * (mean + kappa * std)
+Surrogate = namedtuple('Surrogate', ['method', 'cols', 'length_scale', 'kappa', 'weight', 'k', 'noise'],
+                       defaults=[1.0, 0.5, 5, 0.01])
+
+
+def knn_predict(x, y, query, k=5, noise=0.01):
+    '''
+        Inverse distance weighted mean of the k nearest closed formulas
+        std is the weighted spread of their zi, plus a share of the spread of all closed zi that
+        goes from 0 on a closed formula to all of it far from them, like an RBF kernel.
+    '''
+    k = min(k, len(x))
+    distance, idx = cKDTree(x).query(query, k=k)
+    distance, idx = distance.reshape(len(query), k), idx.reshape(len(query), k)
+    weights = 1.0 / (distance + noise)
+    weights /= weights.sum(axis=1, keepdims=True)
+    mean = (weights * y[idx]).sum(axis=1)
+    local = (weights * (y[idx] - mean[:, None]) ** 2).sum(axis=1)
+    far = 1.0 - np.exp(-0.5 * (weights * distance).sum(axis=1) ** 2)
+    return mean, np.sqrt(local + (y.std() * far) ** 2 + noise ** 2)
+
+
+def gp_predict(x, y, query, k=None, noise=0.01):
+    '''
+        Gaussian process with a unit RBF kernel on the standardized zi
+    '''
+    mu, sd = y.mean(), y.std() or 1.0
+    kernel = np.exp(-0.5 * ((x[:, None] - x[None]) ** 2).sum(axis=-1)) + noise * np.eye(len(x))
+    cross = np.exp(-0.5 * ((query[:, None] - x[None]) ** 2).sum(axis=-1))
+    factor = cho_factor(kernel, lower=True)
+    mean = mu + sd * cross @ cho_solve(factor, (y - mu) / sd)
+    var = 1.0 - (cross * cho_solve(factor, cross.T).T).sum(axis=1)
+    return mean, sd * np.sqrt(np.clip(var, 0, None))
+
+
+# Batched predictions (mean, std) of zi at query from the closed formulas x with zi y
+SURROGATES = {
+    'knn': knn_predict,
+    'gp': gp_predict,
+}
+
+
+def predict(surrogate, x, y, query):
+    '''
+        (mean, std) of zi at the query formulas, x and query in the units of surrogate.cols
+    '''
+    scale = np.asarray(surrogate.length_scale, dtype=float)
+    valid = ~np.isnan(y)
+    return SURROGATES[surrogate.method](np.asarray(x, dtype=float)[valid] / scale, np.asarray(y, dtype=float)[valid],
+                                        np.asarray(query, dtype=float) / scale, surrogate.k, surrogate.noise)
+
+
+def screen_open_set(frame, closed_set, params, grid, surrogate, prune=False):
+    '''
+        open_set_frame with the prediction of surrogate (pred, pred_std, pred_ucb), best pred_ucb first
+        prune drops the formulas whose pred_ucb is below the best mean zi of a closed formula.
+    '''
+    cols = [params.index(col) for col in surrogate.cols]
+    closed = grid.to_values(closed_set.lattice.reshape(-1, len(params)))[:, cols]
+    zi = np.array([np.mean(z) for z in closed_set.zi])
+    ret = frame.copy()
+    ret['pred'], ret['pred_std'] = predict(surrogate, closed, zi, ret[list(surrogate.cols)].values)
+    ret['pred_ucb'] = ret['pred'] + surrogate.kappa * ret['pred_std']
+    if prune:
+        ret = ret[ret['pred_ucb'] >= zi.max()]
+    return ret.sort_values(by='pred_ucb', ascending=False)
@@ -0,0 +1,50 @@
+'''
+    Matching well spectra to the target size curves
+'''
+import numpy as np
+import pandas as pd
+
+from common.curve_distance import distance_matrix, nearest_target
+
+
+def calculate_peak_diff(source_peaks, target_peaks):
+    # (wells, targets) first-peak position error, NaN where either curve has no peak
+    return source_peaks['1st_peak_wave'].values[:, None] - target_peaks['1st_peak_wave'].values[None, :]
+
+
+def get_near_wave(spectral_store, rows, target_curves, target_size, target_peaks=None, size_idx=None, peak_idx=None):
+    '''
+        Closest target size of the given store rows, one row per well
+        size_idx / peak_idx pin the curve / peak target instead of taking the closest one.
+        Peak columns are only added when target_peaks is given.
+    '''
+    # Curve error of the given store rows against every target size in one call
+    sources = spectral_store.take(rows)
+    wave_error = distance_matrix(sources, target_curves)
+    min_idx, min_error = nearest_target(wave_error)
+    if size_idx is not None:
+        min_idx = np.full(len(wave_error), size_idx)
+        min_error = wave_error[np.arange(len(wave_error)), min_idx]
+
+    ret = pd.DataFrame({
+        'day': spectral_store.row_keys()[rows],
+        'wave': spectral_store.index['well'].astype(str).values[rows],
+        'size': np.array(target_size)[min_idx],
+        'wave_error': min_error
+    })
+    if target_peaks is None:
+        return ret
+
+    # Peak features are cached by plate hash next to the spectra, only new plates are computed
+    source_peaks = spectral_store.peak_features().iloc[rows]
+    peak_error = calculate_peak_diff(source_peaks, target_peaks)
+    # Closest peak position in either direction, the error itself keeps its sign
+    min_idx_peak = np.argmin(np.where(np.isnan(peak_error), np.inf, np.abs(peak_error)), axis=1)
+    if peak_idx is not None:
+        min_idx_peak = np.full(len(peak_error), peak_idx)
+
+    ret['peak_size'] = np.array(target_size)[min_idx_peak]
+    ret['peak_error'] = peak_error[np.arange(len(peak_error)), min_idx_peak]
+    ret['peak_source'] = source_peaks['1st_peak_wave'].values
+    ret['peak_target'] = target_peaks['1st_peak_wave'].values[min_idx_peak]
+    return ret
@@ -0,0 +1,98 @@
+'''
+    Reading Epoch 2 plate-reader UV-Vis exports
+'''
+import re
+from collections import namedtuple
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+WAVE_COL = u'波长'
+
+# absorbance is a (wavelength, well) matrix, one column per entry of wells
+PlateSpectrum = namedtuple('PlateSpectrum', ['wavelength', 'absorbance', 'wells'])
+
+# e.g. "开始: 400 nm,  停止: 999 nm,  步骤: 1 nm"
+scan_range_pattern = re.compile(r'开始:\s*([\d.]+)\s*nm,\s*停止:\s*([\d.]+)\s*nm,\s*步骤:\s*([\d.]+)\s*nm')
+
+
+def get_scan_points(line):
+    # Number of wavelengths announced by a scan range line, None for any other line
+    m = scan_range_pattern.search(line)
+    if m is None:
+        return None
+    start, stop, step = [float(x) for x in m.groups()]
+    return int(round((stop - start) / step)) + 1
+
+
+def to_float(val):
+    try:
+        return float(val)
+    except ValueError:
+        return np.nan
+
+
+def read_plate_spectrum(fname, encoding='gbk'):
+    '''
+        Parse a plate-reader export in a single pass.
+        Only the wells measured in the first data row are kept, and the number of
+        rows read comes from the scan range in the file header.
+    '''
+    scan_points = None
+    header = None
+    usecols = None
+    getter = None
+    rows = []
+    with open(fname, encoding=encoding) as f:
+        for line in f:
+            if header is None:
+                if scan_points is None:
+                    scan_points = get_scan_points(line)
+                if line.startswith(WAVE_COL + '\t'):
+                    header = line.rstrip('\r\n').split('\t')
+                continue
+
+            v = line.rstrip('\r\n').split('\t')
+            if v[0] == '':
+                break
+            if usecols is None:
+                usecols = [idx for idx, val in enumerate(v) if val != '']
+                if len(usecols) < 2:
+                    raise ValueError(f'{fname}: no wells measured')
+                getter = itemgetter(*usecols)
+            if len(v) > usecols[-1]:
+                rows.append(getter(v))
+            else:
+                rows.append([v[idx] if idx < len(v) else '' for idx in usecols])
+            if len(rows) == scan_points:
+                break
+
+    if header is None or not rows:
+        raise ValueError(f'{fname}: no spectrum block found')
+
+    try:
+        values = np.array(rows, dtype=float)
+    except ValueError:
+        # Saturated or unread wells are exported as '?????' or left empty
+        values = np.vectorize(to_float, otypes=[float])(np.array(rows, dtype=object))
+
+    wells = [header[idx] for idx in usecols[1:]]
+    return PlateSpectrum(values[:, 0], values[:, 1:], wells)
+
+
+def spectrum_to_frame(spectrum):
+    # The DataFrame layout used by the scripts: a 波长 column followed by one column per well
+    wavelength = spectrum.wavelength
+    if np.all(wavelength == np.round(wavelength)):
+        wavelength = wavelength.astype(int)
+    data = pd.DataFrame(spectrum.absorbance, columns=spectrum.wells)
+    data.insert(0, WAVE_COL, wavelength)
+    return data
+
+
+def frame_to_spectrum(data):
+    # Inverse of spectrum_to_frame, used for the normalized spectra kept in workbooks
+    well_cols = [col for col in data.columns if col != WAVE_COL]
+    return PlateSpectrum(data[WAVE_COL].values.astype(float), data[well_cols].values.astype(float),
+                         [str(col) for col in well_cols])
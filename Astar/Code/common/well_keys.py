@@ -0,0 +1,114 @@
+'''
+    Integer keys of a well: (material, shape type, day, batch, well)
+    Formula rows and spectrum wells are joined and filtered on these codes instead of on
+    '小尺寸AuNSs_20230724-1_A1' strings built row by row. Each distinct day or plate key is
+    parsed once, then the codes are gathered for every row.
+'''
+import numpy as np
+import pandas as pd
+
+from common.spectral_store import split_spectrum_key
+
+MATERIALS = ['AuNSs', 'AgNCs', 'AuNRs']
+# Index is the code of the formula type column, 0 when a plate has no shape prefix
+SHAPE_NAMES = ['', '小尺寸', '多面体', '大尺寸']
+SHAPE_SMALL, SHAPE_POLYHEDRON, SHAPE_LARGE = 1, 2, 3
+TYPE_COL = 'type(1小尺寸，2-多面体，3-大尺寸)'
+
+KEY_COLS = ['material', 'shape', 'day', 'plate', 'well']
+
+
+def encode_wells(wells):
+    '''
+        'A1' -> 101, 'H12' -> 812, -1 for anything that is not a plate well
+    '''
+    codes, uniques = pd.factorize(pd.Series(wells).astype(str), use_na_sentinel=False)
+    parts = pd.Series(uniques, dtype=str).str.extract(r'^([A-Z])(\d+)$')
+    row = parts[0].fillna('@').map(ord).values - ord('@')
+    col = pd.to_numeric(parts[1], errors='coerce').fillna(-1).astype(np.int64).values
+    table = np.where((row > 0) & (col >= 0), row * 100 + col, -1)
+    return table[codes]
+
+
+def encode_days(days):
+    # '20230724' -> 20230724, -1 when the day is not a date
+    codes, uniques = pd.factorize(pd.Series(days).astype(str), use_na_sentinel=False)
+    table = pd.to_numeric(pd.Series(uniques), errors='coerce').fillna(-1).astype(np.int64).values
+    return table[codes]
+
+
+def split_material(name):
+    # '小尺寸AuNSs' -> (1, 0)
+    shape = max((i for i, prefix in enumerate(SHAPE_NAMES) if name.startswith(prefix)),
+                key=lambda i: len(SHAPE_NAMES[i]))
+    material = name[len(SHAPE_NAMES[shape]):]
+    return shape, MATERIALS.index(material) if material in MATERIALS else -1
+
+
+def pack_keys(keys):
+    '''
+        One int64 per row, -1 when any part is unknown
+    '''
+    key = ((((keys['material'].values * 10 + keys['shape'].values) * 10 ** 8 + keys['day'].values) * 100
+            + keys['plate'].values) * 1000 + keys['well'].values)
+    valid = np.all([keys[col].values >= 0 for col in KEY_COLS], axis=0) & (keys['plate'].values < 100) \
+        & (keys['shape'].values < 10) & (keys['well'].values < 1000)
+    return np.where(valid, key, -1)
+
+
+def make_keys(material, shape, day, plate, well):
+    keys = pd.DataFrame({'material': np.asarray(material, dtype=np.int64), 'shape': np.asarray(shape, dtype=np.int64),
+                         'day': np.asarray(day, dtype=np.int64), 'plate': np.asarray(plate, dtype=np.int64),
+                         'well': np.asarray(well, dtype=np.int64)})
+    keys['key'] = pack_keys(keys)
+    return keys
+
+
+def get_spectrum_keys(days, wells):
+    '''
+        Keys of spectrum wells named by plate key ('小尺寸AuNSs_20230724-1') and well
+    '''
+    codes, uniques = pd.factorize(pd.Series(days).astype(str), use_na_sentinel=False)
+    parts = [split_spectrum_key(key) for key in uniques]
+    materials = np.array([split_material(material) for material, _, _ in parts], dtype=np.int64).reshape(-1, 2)
+    day = encode_days([day for _, day, _ in parts])
+    plate = np.array([plate for _, _, plate in parts], dtype=np.int64)
+    return make_keys(materials[codes, 1], materials[codes, 0], day[codes], plate[codes], encode_wells(wells))
+
+
+def get_formula_keys(data, material, plate_col, well_col='波名'):
+    '''
+        Keys of formula rows; the shape comes from the type column and the batch from plate_col
+    '''
+    shape = pd.to_numeric(data[TYPE_COL], errors='coerce').fillna(0).astype(np.int64).values
+    shape = np.where((shape >= 0) & (shape < len(SHAPE_NAMES)), shape, 0)
+    plate = pd.to_numeric(data[plate_col], errors='coerce').fillna(-1).astype(np.int64).values
+    return make_keys(np.full(len(data), MATERIALS.index(material)), shape, encode_days(data['day']), plate,
+                     encode_wells(data[well_col]))
+
+
+def format_day_names(keys):
+    '''
+        Plate names of keys, e.g. '小尺寸AuNSs_20230724-1' (unknown materials are left empty)
+    '''
+    materials = np.array(MATERIALS + [''], dtype=object)
+    names = pd.Series(np.array(SHAPE_NAMES, dtype=object)[keys['shape'].values]) \
+        + materials[keys['material'].values] + '_' + keys['day'].astype(str).values \
+        + '-' + keys['plate'].astype(str).values
+    return names.values
+
+
+def join_wells(left, left_keys, right, right_keys):
+    '''
+        Inner join of two tables on their well keys, in the row order of pd.merge
+        Columns of right that left already has are taken from left. Returns the joined
+        table and its keys.
+    '''
+    left_rows = pd.DataFrame({'key': left_keys['key'].values, 'left_row': np.arange(len(left))})
+    right_rows = pd.DataFrame({'key': right_keys['key'].values, 'right_row': np.arange(len(right))})
+    rows = pd.merge(left_rows[left_rows['key'] >= 0], right_rows[right_rows['key'] >= 0], on='key', how='inner')
+
+    right = right[[col for col in right.columns if col not in left.columns]]
+    joined = pd.concat([left.iloc[rows['left_row'].values].reset_index(drop=True),
+                        right.iloc[rows['right_row'].values].reset_index(drop=True)], axis=1)
+    return joined, left_keys.iloc[rows['left_row'].values].reset_index(drop=True)
@@ -0,0 +1,44 @@
+'''
+    Fit a PCA basis over every archived spectrum and keep each well as a few coefficients
+    Usage: python compress_spectra.py, from the folder holding AgNCs_data, AuNSs_data and AuNRs_data
+'''
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from common.curve_distance import distance_matrix
+from common.file_cache import CACHE_DIR
+from common.ingest import ingest_dirs
+from common.spectral_pca import compress, distance_bound, fit_basis, reduced_distance, save_compressed
+from common.spectral_store import SpectralStore
+
+archive_dir_list = ["AgNCs_data/normalization",
+                    "AuNSs_data/normalization",
+                    "AuNRs_data/UV-Vis_Data"
+                    ]
+ingest = ingest_dirs([d for d in archive_dir_list if os.path.isdir(d)])
+for file_path, error in ingest.failures:
+    print(f'skip {file_path}: {error}')
+spectral_store = SpectralStore.build(f'{CACHE_DIR}/archive_spectra', ingest.wave_name_dict)
+
+basis = fit_basis(spectral_store.wavelength, spectral_store.matrix)
+coefficients, residual = compress(basis, spectral_store.wavelength, spectral_store.matrix)
+save_compressed(f'{CACHE_DIR}/archive_spectra/pca.npz', basis, coefficients, residual)
+
+compressed = ~np.isnan(residual)
+print(f'{len(basis.components)} components over {basis.wavelength[0]:g}-{basis.wavelength[-1]:g} nm, '
+      f'{compressed.sum()} of {len(residual)} wells compressed')
+print(f'reconstruction RMSE <= {np.nanmax(residual):.5f} (fit bound {basis.rmse:.5f}), '
+      f'{len(basis.wavelength) / len(basis.components):.1f}x fewer values per well')
+
+# Spot check: distances from the coefficients against the raw curves over the same band
+rows = np.flatnonzero(compressed)[:200]
+band = np.searchsorted(spectral_store.wavelength, basis.wavelength)
+exact = np.sqrt(distance_matrix(np.asarray(spectral_store.matrix[rows])[:, band],
+                                np.asarray(spectral_store.matrix[rows])[:, band]))
+approx = np.sqrt(reduced_distance(basis, coefficients[rows], coefficients[rows]))
+bound = distance_bound(residual[rows], residual[rows])
+print(f'RMSE distance error max {np.abs(exact - approx).max():.5f}, '
+      f'within bound: {bool(np.all(np.abs(exact - approx) <= bound + 1e-9))}')
@@ -0,0 +1,13 @@
+'''
+    Export machine outputs to Excel workbooks
+    Usage: python export_excel.py [name ...], every table in output/ when no name is given
+'''
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from common.report import export_excel, list_outputs
+
+names = sys.argv[1:] or list_outputs()
+for name in names:
+    print(f'{name} -> {export_excel(name)}')
@@ -0,0 +1,29 @@
+'''
+    Find the past wells whose spectra are closest to each curve of a target workbook
+    Usage: python search_history.py target/归一化uv数据.xlsx [k]
+    The index is filled by the AgNCs, AuNSs and AuNRs scripts run from the same folder.
+'''
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from common.file_cache import CACHE_DIR
+from common.spectral_index import SpectralIndex
+
+target_file = sys.argv[1]
+k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+data_target = pd.read_excel(target_file, skiprows=2)
+use_cols = list(filter(lambda x: 'Unnamed' not in x, data_target.columns))
+wave_cols = list(filter(lambda x: '波长' in x, use_cols))
+absor_cols = list(filter(lambda x: '吸光度' in x, use_cols))
+
+spectral_index = SpectralIndex.open(f'{CACHE_DIR}/spectral_index')
+for wcol, acol in zip(wave_cols, absor_cols):
+    curve = data_target[[wcol, acol]].dropna()
+    near = spectral_index.search(curve[wcol].values, curve[acol].values, k)
+    print(f'[{acol}]')
+    print(near.dropna(axis=1, how='all').to_string(index=False))
+    print('')
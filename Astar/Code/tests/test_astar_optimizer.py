@@ -0,0 +1,289 @@
+'''
+    Checks of the optimizer structures against plain loops over the formulas
+    Usage: python -m pytest -q tests
+'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.astar_optimizer import (ParamGrid, ParetoFront, TableSearch, build_closed_set, build_neighbour_graph,
+                                   build_open_set)
+from common.checkpoint import load_checkpoint
+from common.feature_table import PARAM_COLS
+
+# Dispense resolution and typical volume of every AuNRs reagent; 超纯水 is around 100 mL
+RESOLUTION = [0.001, 0.0001, 0.0001, 0.001, 0.001, 0.001, 0.001, 0.001]
+CENTER = [100.0, 0.36, 0.06, 5.0, 0.5, 0.05, 0.05, 0.2]
+
+# Neighbour columns and thresholds of the AuNRs scripts
+GRAPH_COLS = ['3.6542M 盐酸/mL', '4mM AgNO3/mL', '晶种/mL']
+GRAPH_THRES = [0.006, 0.05, 0.03]
+
+
+def brute_closed_set(lattice, zi):
+    ret = {}
+    for row, z in zip(map(tuple, lattice), zi):
+        if not np.isnan(z):
+            ret.setdefault(row, []).append(z)
+    return ret
+
+
+def brute_open_set(closed, gap, thres, cnt_limit, near_gap=None, near_thres=None, positive=False):
+    '''
+        build_open_set as plain loops: closed formulas one by one, one parameter and direction at a time
+        As in build_open_set, and unlike the loops of the original scripts, cnt counts every formula
+        that is not closed, and near-grid zi is added once every formula is open.
+    '''
+    ret = {}
+    for row, z in closed.items():
+        for idx in range(len(row)):
+            for sign in (1, -1):
+                cnt = 0
+                for k in range(1, thres[idx] // gap[idx] + 1 if gap[idx] > 0 else 1):
+                    new = list(row)
+                    new[idx] += sign * k * gap[idx]
+                    new = tuple(new)
+                    if new in closed or (positive and new[idx] <= 0):
+                        continue
+                    cnt += 1
+                    if cnt > cnt_limit:
+                        break
+                    ret.setdefault(new, [])
+                    if near_gap is None:
+                        ret[new] += z
+    if near_gap is not None:
+        for row, z in closed.items():
+            for idx in range(len(row)):
+                for sign in (1, -1):
+                    for k in range(1, near_thres[idx] // near_gap[idx] + 1 if near_gap[idx] > 0 else 1):
+                        new = list(row)
+                        new[idx] += sign * k * near_gap[idx]
+                        if tuple(new) in ret:
+                            ret[tuple(new)] += z
+    return ret
+
+
+def original_open_set(closed, gap, thres, cnt_limit):
+    # The loop of the original AgNCs script, on grid steps
+    ret = {}
+    for row, z in closed.items():
+        for idx in range(len(row)):
+            for sign in (1, -1):
+                cnt = 0
+                step = gap[idx]
+                while cnt < cnt_limit and step <= thres[idx]:
+                    new = list(row)
+                    new[idx] += sign * step
+                    new = tuple(new)
+                    if new not in closed:
+                        if new not in ret:
+                            ret[new] = list(z)
+                            cnt += 1
+                        else:
+                            ret[new] += z
+                    step += gap[idx]
+    return ret
+
+
+def brute_neighbours(values, thres):
+    # Rows within thres of every row, nearest first and ties in row order
+    ret = []
+    for i in range(len(values)):
+        distance = [(np.max(np.abs(values[j] - values[i]) / thres), j) for j in range(len(values)) if j != i]
+        ret.append([j for d, j in sorted(distance) if d < 1])
+    return ret
+
+
+def campaign(n, seed=0):
+    # Formulas a few grid steps around CENTER, with repeats, as a real campaign table
+    rng = np.random.default_rng(seed)
+    steps = rng.integers(-3, 4, size=(n, len(PARAM_COLS)))
+    steps[n // 2:] = steps[:n - n // 2]
+    data = pd.DataFrame(np.asarray(CENTER) + steps * np.asarray(RESOLUTION), columns=PARAM_COLS)
+    zi = rng.random(n)
+    zi[::17] = np.nan
+    return data, zi
+
+
+def test_eight_parameters_match_brute_force():
+    grid = ParamGrid(RESOLUTION)
+    data, zi = campaign(400)
+    closed_set = build_closed_set(data, PARAM_COLS, zi, grid)
+    closed = brute_closed_set(grid.to_lattice(data[PARAM_COLS].values), zi)
+    assert list(map(tuple, closed_set.lattice)) == list(closed)
+    assert closed_set.zi == list(closed.values())
+
+    gap = [2 * r for r in RESOLUTION]
+    thres = [6 * r for r in RESOLUTION]
+    for near_gap, near_thres in [(None, None), (RESOLUTION, gap)]:
+        open_set = build_open_set(closed_set, grid, gap, thres, 2, near_gap, near_thres, positive=True)
+        expected = brute_open_set(closed, grid.steps(gap), grid.steps(thres), 2,
+                                  None if near_gap is None else grid.steps(near_gap),
+                                  None if near_thres is None else grid.steps(near_thres), positive=True)
+        assert list(map(tuple, open_set.lattice)) == list(expected)
+        assert open_set.zi == list(expected.values())
+
+
+def test_short_runs_match_the_original_loops():
+    # With thres // gap <= cnt_limit the cnt_limit counting rule makes no difference
+    grid = ParamGrid(RESOLUTION)
+    data, zi = campaign(400, seed=1)
+    closed_set = build_closed_set(data, PARAM_COLS, zi, grid)
+    closed = brute_closed_set(grid.to_lattice(data[PARAM_COLS].values), zi)
+    gap = [2 * r for r in RESOLUTION]
+    thres = [4 * r for r in RESOLUTION]
+    open_set = build_open_set(closed_set, grid, gap, thres, 2)
+    expected = original_open_set(closed, grid.steps(gap), grid.steps(thres), 2)
+    assert list(map(tuple, open_set.lattice)) == list(expected)
+    assert open_set.zi == list(expected.values())
+
+
+def test_distinct_formulas_keep_distinct_rows():
+    # Formulas whose grid steps would overlap if the parameters shared one packed integer
+    grid = ParamGrid(RESOLUTION)
+    data = pd.DataFrame([CENTER, CENTER], columns=PARAM_COLS)
+    data.iloc[0, 0] += 0.1
+    data.iloc[1, 0] -= 0.028
+    data.iloc[1, 1] += 0.0001
+    closed_set = build_closed_set(data, PARAM_COLS, np.array([1.0, 2.0]), grid)
+    assert len(closed_set.lattice) == 2
+    assert closed_set.zi == [[1.0], [2.0]]
+
+    open_set = build_open_set(closed_set, grid, [0.1] + RESOLUTION[1:], [0.2] + RESOLUTION[1:], 2)
+    assert not (open_set.lattice == closed_set.lattice[1]).all(axis=1).any()
+    assert len(set(map(tuple, open_set.lattice))) == len(open_set.lattice)
+
+
+def test_neighbour_graph_matches_brute_force():
+    rng = np.random.default_rng(1)
+    # Values on the dispense grid, so many pairs tie or sit exactly on a threshold
+    data = pd.DataFrame(rng.integers(0, 20, size=(300, 3)) * np.array([0.001, 0.01, 0.01]), columns=GRAPH_COLS)
+    graph = build_neighbour_graph(data, GRAPH_COLS, GRAPH_THRES)
+    expected = brute_neighbours(data.values, np.array(GRAPH_THRES))
+    assert [graph.indices[graph.indptr[i]:graph.indptr[i + 1]].tolist() for i in range(len(data))] == expected
+
+    # Shuffling the table permutes the graph and nothing else
+    order = rng.permutation(len(data))
+    shuffled = build_neighbour_graph(data.iloc[order].reset_index(drop=True), GRAPH_COLS, GRAPH_THRES)
+    for new, old in enumerate(order):
+        neighbours = order[shuffled.indices[shuffled.indptr[new]:shuffled.indptr[new + 1]]]
+        assert sorted(neighbours.tolist()) == sorted(expected[old])
+
+
+def search_table(n=400, seed=2):
+    # A candidate table with the measured columns of the AuNRs objectives
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(rng.integers(0, 20, size=(n, 3)) * np.array([0.001, 0.01, 0.01]), columns=GRAPH_COLS)
+    data['2nd_peak_wave'] = 550 + 2000 * data[GRAPH_COLS[0]] + 300 * data[GRAPH_COLS[2]] + rng.normal(0, 5, n)
+    data['2nd_peak_ratio'] = 1 + 2 * data[GRAPH_COLS[1]] + rng.random(n)
+    return data, build_neighbour_graph(data, GRAPH_COLS, GRAPH_THRES)
+
+
+def run_search(data, graph, max_step, checkpoint=None, target=650, batch_size=2):
+    search = TableSearch(data, ['lspr', 'peak_ratio'], graph, target, acquisition='thompson', mode='pareto')
+    step, reached = search.run(np.arange(0, 400, 40), max_step, stop=lambda results: (results > 720).any(),
+                               rng=np.random.default_rng(3), batch_size=batch_size, checkpoint=checkpoint)
+    return search, step, reached
+
+
+def brute_front(values):
+    # Rows no other row dominates, of equal rows only the first
+    front = []
+    for i, value in enumerate(values):
+        if np.isnan(value).any():
+            continue
+        dominated = any(not np.isnan(other).any() and (other >= value).all() and (other > value).any()
+                        for other in values)
+        repeated = any((other == value).all() for other in values[:i])
+        if not dominated and not repeated:
+            front.append(i)
+    return front
+
+
+@pytest.mark.parametrize('m', [1, 2, 3])
+def test_pareto_front_matches_brute_force(m):
+    rng = np.random.default_rng(m)
+    # Few distinct values give equal rows and rows that tie on some objectives
+    values = rng.integers(0, 6, size=(200, m)).astype(float)
+    values[rng.choice(200, 10, replace=False), rng.integers(0, m, 10)] = np.nan
+    front = ParetoFront(m)
+    for rows in np.array_split(np.arange(200), 13):
+        front.add(rows, values[rows])
+    assert front.rows.tolist() == brute_front(values)
+    assert np.array_equal(front.values, values[front.rows])
+
+
+def brute_select(score, open_rows, neighbours, topk, penalty):
+    # Every pick rescans the open rows with the penalties of the rows picked so far
+    hits = np.zeros(len(score), dtype=int)
+    picked = []
+    for _ in range(topk):
+        candidates = [row for row in open_rows if row not in picked]
+        if not candidates:
+            break
+        row = min(candidates, key=lambda row: (-(score[row] - penalty * hits[row]), row))
+        picked.append(row)
+        hits[neighbours(row)] += 1
+    return picked
+
+
+@pytest.mark.parametrize('topk, penalty', [(1, 0.05), (4, 0.0), (4, 0.05), (8, 0.2), (50, 0.1)])
+def test_select_matches_brute_force(topk, penalty):
+    data, graph = search_table()
+    rng = np.random.default_rng(topk)
+    search = TableSearch(data, 'lspr', graph, 650)
+    open_rows = np.sort(rng.choice(len(data), 40, replace=False))
+    # Rounded scores give ties, which go to the row that comes first in the table
+    score = np.round(rng.random(len(data)), 1)
+    search.is_open[open_rows] = True
+    search.si_ucb[open_rows] = score[open_rows]
+    search.open_heap.push(open_rows, score[open_rows])
+
+    picked = search.select(topk, penalty)
+    assert picked.tolist() == brute_select(score, open_rows.tolist(), search.neighbours, topk, penalty)
+    # The rows left in the open set are back on their own score
+    left = np.setdiff1d(open_rows, picked)
+    assert np.array_equal(search.open_heap.score[left], score[left])
+    assert np.isnan(search.open_heap.score[picked]).all()
+    assert len(search.open_heap) == len(left)
+
+
+def test_resume_equals_uninterrupted(tmp_path):
+    data, graph = search_table()
+    expected, step, reached = run_search(data, graph, 30)
+    checkpoint = str(tmp_path / 'state.npz')
+    run_search(data, graph, 12, checkpoint)
+    assert int(load_checkpoint(checkpoint)['next_step']) == 12
+    search, resumed_step, resumed_reached = run_search(data, graph, 30, checkpoint)
+    assert (resumed_step, resumed_reached) == (step, reached)
+    pd.testing.assert_frame_equal(search.frame(), expected.frame())
+    assert search.front.rows.tolist() == expected.front.rows.tolist()
+
+
+def test_restore_rejects_another_campaign(tmp_path):
+    data, graph = search_table()
+    checkpoint = str(tmp_path / 'state.npz')
+    run_search(data, graph, 5, checkpoint)
+    with pytest.raises(ValueError):
+        run_search(data, graph, 30, checkpoint, target=700)
+    with pytest.raises(ValueError):
+        run_search(data, graph, 30, checkpoint, batch_size=3)
+    search = TableSearch(data, ['lspr', 'peak_ratio'], graph, 650, acquisition='thompson', mode='pareto')
+    with pytest.raises(ValueError):
+        search.restore(load_checkpoint(checkpoint), start_rows=np.arange(0, 400, 50), batch_size=2)
+
+
+def test_checkpoint_of_another_table_starts_over(tmp_path):
+    data, graph = search_table()
+    checkpoint = str(tmp_path / 'state.npz')
+    run_search(data, graph, 12, checkpoint)
+    # The same number of rows, measured again
+    data = data.assign(**{'2nd_peak_wave': data['2nd_peak_wave'] + 1.0})
+    expected, step, reached = run_search(data, graph, 30)
+    search, resumed_step, resumed_reached = run_search(data, graph, 30, checkpoint)
+    assert (resumed_step, resumed_reached) == (step, reached)
+    pd.testing.assert_frame_equal(search.frame(), expected.frame())
@@ -0,0 +1,38 @@
+'''
+    FeatureIndex windows against scanning every row
+    Usage: python -m pytest -q tests
+'''
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.feature_index import FeatureIndex
+
+
+def brute_window(values, labels, keep):
+    rows = [i for i, value in enumerate(values) if not np.isnan(value) and keep(value)]
+    rows.sort(key=lambda i: values[i])
+    return [labels[i] for i in rows]
+
+
+def test_windows_match_a_scan():
+    rng = np.random.default_rng(0)
+    # Rounded values give ties and windows that end exactly on a value
+    values = np.round(rng.uniform(500, 900, 300), -1)
+    values[rng.choice(300, 20, replace=False)] = np.nan
+    labels = rng.permutation(1000)[:300]
+    index = FeatureIndex(values, labels)
+    assert len(index) == 280
+
+    windows = [(600, 700), (600, 600), (700, 600), (0, 2000), (900, 1000), (650, 650.5), (-np.inf, 520)]
+    for lo, hi in windows:
+        assert index.between(lo, hi).tolist() == brute_window(values, labels, lambda v: lo < v < hi)
+        assert index.outside(lo, hi).tolist() == brute_window(values, labels, lambda v: v < lo or v > hi)
+
+
+def test_labels_default_to_row_positions():
+    index = FeatureIndex([3.0, np.nan, 1.0, 2.0])
+    assert index.between(0, 10).tolist() == [2, 3, 0]
+    assert index.outside(1.5, 2.5).tolist() == [2, 0]
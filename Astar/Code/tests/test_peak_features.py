@@ -0,0 +1,38 @@
+'''
+    Peak features of real AuNRs plates
+    Usage: python -m pytest -q tests
+'''
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.feature_table import LSPR_BAND
+from common.peak_features import get_curve_peaks, get_peak_features
+from common.uv_vis import read_plate_spectrum
+
+UV_VIS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data', 'AuNRs_Data', 'UV-Vis_Data')
+
+
+def test_lspr_band_skips_the_water_band():
+    spectrum = read_plate_spectrum(os.path.join(UV_VIS_DIR, '20230320-2.txt'))
+    a1 = spectrum.absorbance[:, spectrum.wells.index('A1')].astype(float)
+    # The longest-wavelength peak of A1 is the water overtone band, the LSPR is at 659 nm
+    assert get_curve_peaks(spectrum.wavelength, a1)['2nd_peak_wave'] > 950
+    peaks = get_curve_peaks(spectrum.wavelength, a1, band=LSPR_BAND)
+    assert peaks['1st_peak_wave'] == 517
+    assert peaks['2nd_peak_wave'] == 659
+    assert peaks['2nd_peak_ratio'] > 1
+
+    features = get_peak_features(spectrum.wavelength, spectrum.absorbance.T, band=LSPR_BAND)
+    lspr = features['2nd_peak_wave'].dropna()
+    assert len(lspr) > 0 and lspr.between(*LSPR_BAND).all()
+
+
+def test_band_without_peaks_leaves_the_2nd_peak_empty():
+    wavelength = np.arange(400, 1000, dtype=float)
+    curve = np.exp(-0.5 * ((wavelength - 520) / 20) ** 2) + 0.5 * np.exp(-0.5 * ((wavelength - 970) / 10) ** 2)
+    peaks = get_curve_peaks(wavelength, curve, band=LSPR_BAND)
+    assert peaks['peak_num'] == 2 and peaks['1st_peak_wave'] == 520
+    assert np.isnan(peaks['2nd_peak_wave']) and np.isnan(peaks['2nd_peak_ratio'])
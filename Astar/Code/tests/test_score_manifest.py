@@ -0,0 +1,85 @@
+'''
+    Incremental scoring against scoring every well from scratch
+    Usage: python -m pytest -q tests
+'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.score_manifest import score_plates
+from common.uv_vis import PlateSpectrum
+
+WAVELENGTH = np.arange(400, 410, dtype=float)
+
+
+class FakeStore:
+    def __init__(self, plates):
+        # plates: {day: (wavelength, well) absorbance}, one well per column
+        self.plates = plates
+        self.matrix = np.concatenate([absorbance.T for absorbance in plates.values()])
+        self.index = pd.DataFrame({'well': [f'A{i + 1}' for absorbance in plates.values()
+                                            for i in range(absorbance.shape[1])]})
+
+    def keys(self):
+        return list(self.plates)
+
+    def row_keys(self):
+        return np.array([day for day, absorbance in self.plates.items() for _ in range(absorbance.shape[1])])
+
+    def plate(self, key):
+        absorbance = self.plates[key]
+        return PlateSpectrum(WAVELENGTH, absorbance, [f'A{i + 1}' for i in range(absorbance.shape[1])])
+
+
+def make_plates(seed, days):
+    rng = np.random.default_rng(seed)
+    return {day: rng.random((len(WAVELENGTH), n)) for day, n in days}
+
+
+def score_from_scratch(store, target):
+    return pd.DataFrame({'day': store.row_keys(), 'wave': store.index['well'].values,
+                         'score': store.matrix.sum(axis=1) * target})
+
+
+def run(path, store, target):
+    calls = []
+
+    def score_rows(rows):
+        calls.append(rows)
+        return score_from_scratch(store, target).iloc[rows].reset_index(drop=True)
+    scores = score_plates(path, store, str(target), score_rows)
+    pd.testing.assert_frame_equal(scores.results, score_from_scratch(store, target))
+    return scores.scored, calls
+
+
+def test_only_new_and_changed_plates_are_scored(tmp_path):
+    path = str(tmp_path)
+    plates = make_plates(0, [('day_1', 3), ('day_2', 4), ('day_3', 2)])
+    scored, calls = run(path, FakeStore(plates), 1)
+    assert list(scored) == list(range(9)) and len(calls) == 1
+
+    scored, calls = run(path, FakeStore(plates), 1)
+    assert len(scored) == 0 and len(calls) == 0
+
+    # day_2 is measured again and day_4 is new; day_1 and day_3 keep their scores
+    plates['day_2'] = plates['day_2'] + 1
+    plates['day_4'] = make_plates(1, [('day_4', 2)])['day_4']
+    scored, calls = run(path, FakeStore(plates), 1)
+    assert list(scored) == [3, 4, 5, 6, 9, 10]
+
+    # Removing a plate keeps the other scores and scores nothing
+    del plates['day_1']
+    scored, calls = run(path, FakeStore(plates), 1)
+    assert len(scored) == 0
+
+
+def test_another_target_scores_every_well(tmp_path):
+    path = str(tmp_path)
+    store = FakeStore(make_plates(0, [('day_1', 3), ('day_2', 4)]))
+    run(path, store, 1)
+    scored, calls = run(path, store, 2)
+    assert list(scored) == list(range(7))
+    assert os.path.exists(f'{path}/scores.pkl')
@@ -0,0 +1,76 @@
+'''
+    Surrogate predictions against one query at a time
+    Usage: python -m pytest -q tests
+'''
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.surrogate import Surrogate, gp_predict, knn_predict, predict
+
+
+def closed_formulas(seed, n=60, d=3):
+    rng = np.random.default_rng(seed)
+    x = rng.random((n, d)) * 4
+    return x, np.sin(x).sum(axis=1) + rng.normal(0, 0.1, n), rng.random((25, d)) * 4
+
+
+def brute_knn(x, y, query, k, noise):
+    mean, std = [], []
+    for q in query:
+        distance = np.sqrt(((x - q) ** 2).sum(axis=1))
+        idx = np.argsort(distance)[:k]
+        weights = 1.0 / (distance[idx] + noise)
+        weights /= weights.sum()
+        m = (weights * y[idx]).sum()
+        local = (weights * (y[idx] - m) ** 2).sum()
+        far = 1.0 - np.exp(-0.5 * (weights * distance[idx]).sum() ** 2)
+        mean.append(m)
+        std.append(np.sqrt(local + (y.std() * far) ** 2 + noise ** 2))
+    return np.array(mean), np.array(std)
+
+
+def brute_gp(x, y, query, noise):
+    mu, sd = y.mean(), y.std()
+    kernel = np.array([[np.exp(-0.5 * ((a - b) ** 2).sum()) for b in x] for a in x]) + noise * np.eye(len(x))
+    inverse = np.linalg.inv(kernel)
+    mean, std = [], []
+    for q in query:
+        cross = np.array([np.exp(-0.5 * ((q - a) ** 2).sum()) for a in x])
+        mean.append(mu + sd * cross @ inverse @ ((y - mu) / sd))
+        std.append(sd * np.sqrt(max(1.0 - cross @ inverse @ cross, 0)))
+    return np.array(mean), np.array(std)
+
+
+@pytest.mark.parametrize('k', [1, 5, 100])
+def test_knn_matches_one_query_at_a_time(k):
+    x, y, query = closed_formulas(k)
+    mean, std = knn_predict(x, y, query, k=k)
+    expected_mean, expected_std = brute_knn(x, y, query, min(k, len(x)), 0.01)
+    assert np.allclose(mean, expected_mean) and np.allclose(std, expected_std)
+
+
+def test_gp_matches_one_query_at_a_time():
+    x, y, query = closed_formulas(0)
+    mean, std = gp_predict(x, y, query)
+    expected_mean, expected_std = brute_gp(x, y, query, 0.01)
+    assert np.allclose(mean, expected_mean, atol=1e-6) and np.allclose(std, expected_std, atol=1e-6)
+    # On a closed formula the GP is close to its zi and almost sure of it
+    mean, std = gp_predict(x, y, x[:5])
+    assert np.allclose(mean, y[:5], atol=0.2) and (std < 0.2 * y.std()).all()
+
+
+@pytest.mark.parametrize('method', ['knn', 'gp'])
+def test_predict_scales_formulas_and_skips_nan_zi(method):
+    x, y, query = closed_formulas(1)
+    y[::7] = np.nan
+    length_scale = [0.5, 2.0, 1.0]
+    surrogate = Surrogate(method, ['a', 'b', 'c'], length_scale)
+    valid = ~np.isnan(y)
+    brute = brute_knn if method == 'knn' else lambda x, y, query, k, noise: brute_gp(x, y, query, noise)
+    expected_mean, expected_std = brute(x[valid] / length_scale, y[valid], query / length_scale, 5, 0.01)
+    mean, std = predict(surrogate, x, y, query)
+    assert np.allclose(mean, expected_mean, atol=1e-6) and np.allclose(std, expected_std, atol=1e-6)
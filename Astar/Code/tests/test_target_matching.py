@@ -0,0 +1,47 @@
+'''
+    Closest target size of the synthetic wells against a per-well loop
+    Usage: python -m pytest -q tests
+'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.target_matching import get_near_wave
+
+
+class FakeStore:
+    def __init__(self, matrix, peaks):
+        self.matrix = matrix
+        self.peaks = pd.DataFrame({'1st_peak_wave': peaks})
+        self.index = pd.DataFrame({'well': [f'A{i + 1}' for i in range(len(matrix))]})
+
+    def take(self, rows):
+        return self.matrix[rows]
+
+    def row_keys(self):
+        return np.array(['day_1'] * len(self.matrix))
+
+    def peak_features(self):
+        return self.peaks
+
+
+def test_peak_size_is_the_closest_peak_in_either_direction():
+    rng = np.random.default_rng(0)
+    target_size = [10, 20, 30, 40]
+    target_peaks = pd.DataFrame({'1st_peak_wave': [520.0, 530.0, np.nan, 560.0]})
+    source_peaks = np.append(rng.uniform(500, 580, 50), np.nan)
+    store = FakeStore(rng.random((len(source_peaks), 8)), source_peaks)
+    ret = get_near_wave(store, np.arange(len(source_peaks)), rng.random((4, 8)), target_size, target_peaks)
+
+    for i, source in enumerate(source_peaks):
+        if np.isnan(source):
+            continue
+        # The loop of the original scripts, with the closest peak taken by absolute error
+        errors = [source - target for target in target_peaks['1st_peak_wave']]
+        j = min((k for k in range(len(errors)) if not np.isnan(errors[k])), key=lambda k: abs(errors[k]))
+        assert ret['peak_size'][i] == target_size[j]
+        assert ret['peak_error'][i] == errors[j]
+        assert ret['peak_target'][i] == target_peaks['1st_peak_wave'][j]
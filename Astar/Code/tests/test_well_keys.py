@@ -0,0 +1,65 @@
+'''
+    Well keys against the name strings the original scripts joined on
+    Usage: python -m pytest -q tests
+'''
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.well_keys import (MATERIALS, SHAPE_NAMES, TYPE_COL, encode_wells, format_day_names, get_formula_keys,
+                              get_spectrum_keys, join_wells)
+
+
+def brute_well_code(well):
+    if len(well) < 2 or not ('A' <= well[0] <= 'Z') or not well[1:].isdigit():
+        return -1
+    return (ord(well[0]) - ord('A') + 1) * 100 + int(well[1:])
+
+
+def test_wells_are_encoded_one_by_one():
+    wells = ['A1', 'H12', 'B07', 'a1', 'A', '1A', '', 'Z99', 'A1', 'nan', 'C3 ']
+    assert encode_wells(wells).tolist() == [brute_well_code(well) for well in wells]
+
+
+def make_tables(seed, n):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({'day': rng.choice(['20230724', '20230801', 'bad'], n),
+                         TYPE_COL: rng.choice([0, 1, 2, 3], n),
+                         'plate': rng.choice([1, 2], n),
+                         '波名': rng.choice(['A1', 'A2', 'B1', 'H12', 'X'], n),
+                         'formula': np.arange(n)})
+    spectra = pd.DataFrame({'day': [f'{SHAPE_NAMES[shape]}AuNSs_{day}-{plate}'
+                                    for shape in range(4) for day in ['20230724', '20230801'] for plate in [1, 2]
+                                    for _ in ['A1', 'B1', 'H12']],
+                            'wave': ['A1', 'B1', 'H12'] * 16})
+    spectra['curve'] = np.arange(len(spectra))
+    return data, spectra
+
+
+def test_join_matches_a_merge_on_names():
+    data, spectra = make_tables(0, 200)
+    data_keys = get_formula_keys(data, 'AuNSs', 'plate')
+    spectrum_keys = get_spectrum_keys(spectra['day'], spectra['wave'])
+    joined, joined_keys = join_wells(data, data_keys, spectra, spectrum_keys)
+
+    # Names as the original scripts built them, one row at a time
+    names = data.assign(name=[f'{SHAPE_NAMES[row[TYPE_COL]]}AuNSs_{row["day"]}-{row["plate"]}_{row["波名"]}'
+                              for _, row in data.iterrows()])
+    spectrum_names = spectra.assign(name=spectra['day'] + '_' + spectra['wave'])
+    expected = pd.merge(names, spectrum_names[['name', 'curve']], on='name', how='inner')
+    assert len(expected) > 0
+    assert joined['formula'].tolist() == expected['formula'].tolist()
+    assert joined['curve'].tolist() == expected['curve'].tolist()
+    day_names = format_day_names(joined_keys)
+    assert (pd.Series(day_names) + '_' + joined['波名'].values).tolist() == expected['name'].tolist()
+
+
+def test_spectrum_keys_of_unknown_plates_do_not_join():
+    keys = get_spectrum_keys(['AuNSs_20230724-1', 'Cu2O_20230724-1', 'AuNSs_day-1', '大尺寸AgNCs_20230724'],
+                             ['A1', 'A1', 'A1', 'B2'])
+    assert keys['material'].tolist() == [0, -1, 0, MATERIALS.index('AgNCs')]
+    assert keys['plate'].tolist() == [1, 1, 1, 1]
+    assert (keys['key'].values[1:3] == -1).all() and (keys['key'].values[[0, 3]] >= 0).all()